@@ -1,15 +1,32 @@
+import time
+_boot_started = time.perf_counter()
+
 import os
+import sys
+import csv
+import io
 import json
 import secrets
 import requests
 from datetime import datetime
-from flask import Flask, render_template, request, redirect, url_for, session, jsonify, send_file, flash
+from flask import Flask, Response, g, render_template, request, redirect, url_for, session, jsonify, send_file, flash, stream_with_context
 from werkzeug.utils import secure_filename
-from utils.database import Database
+from utils.database import Database, BOT_EXPORT_QUERIES
 from utils.ai import AIAssistant
+from utils.ai_replies import AIReplyPipeline
 from utils.crypto import CryptoAPI
 from utils.telegram_api import TelegramAPI
 from utils.telegram_auth import validate_telegram_webapp_data
+from utils.ton_payment import TONPayment, NANOTONS_PER_TON
+from utils.ton_watcher import TONWatcher
+from utils.intents import get_matcher
+from utils.leaderboard import LeaderboardStore
+from utils.ledger import LedgerSnapshotter
+from utils.exports import stream_zip, iter_jsonl
+from utils.metrics import RequestMetrics, route_label
+from utils.sql_profiler import SQLProfiler
+from utils.template_library import TemplateLibrary
+from utils.template_bundle import TemplateBundleReader, BundleError
 
 app = Flask(__name__)
 app.secret_key = os.environ.get('SESSION_SECRET', secrets.token_hex(32))
@@ -25,13 +42,34 @@ def from_json_filter(value):
     except:
         return {}
 
-db = Database()
+db = Database(os.environ.get('DATABASE_PATH', 'database.db'))
 ai_assistant = AIAssistant()
+ai_replies = AIReplyPipeline(ai_assistant)
 crypto_api = CryptoAPI()
+ton_payment = TONPayment(db=db)
+leaderboards = LeaderboardStore(db)
+template_library = TemplateLibrary(db)
+template_bundle_reader = TemplateBundleReader()
+
+# Run the payment watcher in-process only when asked to; with several
+# gunicorn workers prefer a single `python -m utils.ton_watcher` process.
+ton_watcher = TONWatcher(db, ton_payment)
+if os.environ.get('TON_WATCHER_ENABLED') == '1':
+    ton_watcher.start()
+
+# Same for coin ledger snapshots: in-process only when asked, else `python -m utils.ledger`
+ledger_snapshotter = LedgerSnapshotter(db)
+if os.environ.get('LEDGER_SNAPSHOTS_ENABLED') == '1':
+    ledger_snapshotter.start()
+
+TINYURL_API_BASE = os.environ.get('TINYURL_API_BASE', 'https://tinyurl.com').rstrip('/')
+
+# Coin packs offered by the mini app's legacy shop buttons (coins -> TON price)
+LEGACY_COIN_PACKS = {1000: 0.99, 5000: 3.99, 15000: 9.99}
 
 def shorten_url(long_url):
     try:
-        response = requests.get(f'https://tinyurl.com/api-create.php?url={long_url}', timeout=5)
+        response = requests.get(f'{TINYURL_API_BASE}/api-create.php', params={'url': long_url}, timeout=5)
         if response.status_code == 200 and response.text.startswith('http'):
             app.logger.info(f"URL shortened successfully: {long_url} → {response.text}")
             return response.text
@@ -60,7 +98,102 @@ def init_templates():
         for filename, (title, description, category) in template_files.items():
             db.add_template(title, description, category, filename)
 
+    # Template content is served from the database; files are only read once to seed it
+    db.migrate_template_files(templates_dir)
+
 init_templates()
+template_library.load()
+
+def report_startup():
+    boot_ms = (time.perf_counter() - _boot_started) * 1000
+    ai_state = 'loaded' if 'google.generativeai' in sys.modules else 'deferred until first use'
+    print(f"Worker {os.getpid()} booted in {boot_ms:.1f} ms (AI backend: {ai_state})")
+
+report_startup()
+
+request_metrics = RequestMetrics()
+
+@app.before_request
+def start_request_metrics():
+    g.metrics_route = route_label(request.url_rule)
+    g.metrics_started = time.perf_counter()
+    request_metrics.start(request.method, g.metrics_route)
+
+@app.after_request
+def record_request_metrics(response):
+    if 'metrics_started' in g:
+        request_metrics.finish(request.method, g.pop('metrics_route'), response.status_code,
+                               time.perf_counter() - g.pop('metrics_started'))
+    return response
+
+@app.teardown_request
+def record_failed_request_metrics(error=None):
+    # after_request is skipped when a view raises, so count those as 500s here
+    if 'metrics_started' in g:
+        request_metrics.finish(request.method, g.pop('metrics_route'), 500,
+                               time.perf_counter() - g.pop('metrics_started'))
+
+def _bearer_token():
+    # Header only: a token in the query string would end up in access logs and browser history
+    authorization = request.headers.get('Authorization', '')
+    return authorization[len('Bearer '):].strip() if authorization.startswith('Bearer ') else ''
+
+def _metrics_token_valid(supplied):
+    token = os.environ.get('METRICS_TOKEN')
+    return bool(token) and secrets.compare_digest(supplied or '', token)
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus scrape endpoint, summed across workers; needs METRICS_TOKEN as a bearer token"""
+    if not os.environ.get('METRICS_TOKEN'):
+        return jsonify({'error': 'Not found'}), 404
+
+    supplied = _bearer_token()
+    if not _metrics_token_valid(supplied):
+        return Response('Unauthorized\n', status=401, mimetype='text/plain',
+                        headers={'WWW-Authenticate': 'Bearer'})
+
+    return Response(request_metrics.render(), mimetype='text/plain; version=0.0.4')
+
+# SQL profiling is opt-in: it wraps every Database connection and costs a little per statement
+sql_profiler = SQLProfiler() if os.environ.get('SQL_PROFILE') == '1' else None
+db.profiler = sql_profiler
+
+@app.before_request
+def start_sql_trace():
+    if sql_profiler:
+        sql_profiler.begin_request()
+
+@app.after_request
+def finish_sql_trace(response):
+    if not sql_profiler:
+        return response
+
+    trace = sql_profiler.end_request(f'{request.method} {route_label(request.url_rule)}')
+    if trace is None:
+        return response
+
+    response.headers['Server-Timing'] = f'sql;dur={trace["total_ms"]:.1f};desc="{trace["queries"]} queries"'
+    # X-Debug-SQL: <METRICS_TOKEN> dumps the statement trace; never without a configured token
+    debug = request.headers.get('X-Debug-SQL')
+    if debug and _metrics_token_valid(debug):
+        response.headers['X-SQL-Trace'] = json.dumps(trace, separators=(',', ':'), ensure_ascii=True)[:16000]
+    return response
+
+@app.teardown_request
+def discard_sql_trace(error=None):
+    if sql_profiler:
+        sql_profiler.end_request(f'{request.method} {route_label(request.url_rule)}')
+
+@app.route('/debug/sql')
+def debug_sql():
+    """Top statements by total time and recently flagged requests; needs SQL_PROFILE=1 and METRICS_TOKEN"""
+    supplied = _bearer_token()
+    if not sql_profiler or not _metrics_token_valid(supplied):
+        return jsonify({'error': 'Not found'}), 404
+
+    limit = max(1, min(request.args.get('limit', 20, type=int), 200))
+    return jsonify({'top': sql_profiler.top(limit), 'flagged': list(sql_profiler.flagged)})
 
 def login_required(f):
     from functools import wraps
@@ -187,16 +320,6 @@ def create_bot():
             'bot_link': f'https://t.me/{bot_username}' if bot_username else None
         })
 
-        bot_id = db.create_bot(session['user_id'], bot_name, bot_token, bot_config, bot_type)
-
-        # Update bot username in database
-        if bot_username:
-            conn = db.get_connection()
-            cursor = conn.cursor()
-            cursor.execute('UPDATE bots SET bot_username = ? WHERE id = ?', (bot_username, bot_id))
-            conn.commit()
-            conn.close()
-
         # Add default commands for the bot (including built-in commands that are now editable)
         default_commands = [
             ('start', 'text', f'👋 Welcome to {bot_name}!\n\nI\'m here to help you. Use /help to see available commands.'),
@@ -214,8 +337,8 @@ def create_bot():
             ('faq', 'text', '❓ Frequently Asked Questions\n\nQ: How do I use this bot?\nA: Simply send commands starting with /\n\nQ: Is this bot free?\nA: Yes, basic features are completely free!\n\nQ: How do I report issues?\nA: Use /feedback to send us a message\n\nQ: Can I customize responses?\nA: Contact the bot owner for customization options')
         ]
 
-        for command, response_type, response_content in default_commands:
-            db.add_bot_command(bot_id, command, response_type, response_content)
+        bot_id = db.create_bot(session['user_id'], bot_name, bot_token, bot_config, bot_type,
+                               bot_username=bot_username, commands=default_commands)
 
         return redirect(url_for('bot_detail', bot_id=bot_id))
 
@@ -380,58 +503,78 @@ def export_bot(bot_id):
     if not bot or bot['user_id'] != session['user_id']:
         return redirect(url_for('dashboard'))
 
-    commands = db.get_bot_commands(bot_id)
-
-    export_data = {
-        'bot_name': bot['bot_name'],
-        'commands': [
-            {
+    def generate():
+        header = {
+            'bot_name': bot['bot_name'],
+            'config': json.loads(bot['bot_config']) if bot['bot_config'] else {},
+            'exported_at': datetime.now().isoformat()
+        }
+        yield json.dumps(header, indent=2)[:-2] + ',\n  "commands": ['
+        for index, cmd in enumerate(db.iter_bot_export_rows('commands', bot_id)):
+            yield (',' if index else '') + '\n    ' + json.dumps({
                 'command': cmd['command'],
                 'response_type': cmd['response_type'],
                 'response_content': cmd['response_content']
-            }
-            for cmd in commands
-        ],
-        'config': json.loads(bot['bot_config']) if bot['bot_config'] else {},
-        'exported_at': datetime.now().isoformat()
-    }
+            })
+        yield '\n  ]\n}\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/json',
+                    headers={'Content-Disposition': f'attachment; filename=bot_config_{bot_id}.json'})
 
-    filename = f'bot_config_{bot_id}.json'
-    filepath = f'/tmp/{filename}'
+@app.route('/account/export')
+@login_required
+def export_account():
+    """Stream every bot of the account, with its commands and mining data, as a ZIP of JSON files"""
+    bots = db.get_user_bots(session['user_id'])
+
+    def entries():
+        yield 'manifest.json', [json.dumps({
+            'exported_at': datetime.now().isoformat(),
+            'bots': [{'id': bot['id'], 'bot_name': bot['bot_name'], 'bot_type': bot['bot_type']} for bot in bots],
+            'datasets': ['bot.json'] + [f'{dataset}.jsonl' for dataset in BOT_EXPORT_QUERIES]
+        }, indent=2).encode('utf-8')]
 
-    with open(filepath, 'w') as f:
-        json.dump(export_data, f, indent=2)
+        for bot in bots:
+            bot_data = {key: value for key, value in bot.items() if key != 'bot_token'}
+            bot_data['bot_config'] = json.loads(bot['bot_config']) if bot['bot_config'] else {}
+            yield f'bots/{bot["id"]}/bot.json', [json.dumps(bot_data, indent=2, default=str).encode('utf-8')]
+            for dataset in BOT_EXPORT_QUERIES:
+                yield f'bots/{bot["id"]}/{dataset}.jsonl', iter_jsonl(db.iter_bot_export_rows(dataset, bot['id']))
 
-    return send_file(filepath, as_attachment=True, download_name=filename)
+    filename = f'account_export_{datetime.now().strftime("%Y%m%d")}.zip'
+    return Response(stream_with_context(stream_zip(entries())), mimetype='application/zip',
+                    headers={'Content-Disposition': f'attachment; filename={filename}'})
 
 @app.route('/marketplace')
 @login_required
 def marketplace():
-    templates = db.get_all_templates()
+    query = request.args.get('q', '').strip()
+    category = request.args.get('category', '').strip() or None
+    page = max(1, request.args.get('page', 1, type=int))
+    per_page = 24
 
-    for template in templates:
-        try:
-            with open(f'templates_library/{template["json_file"]}', 'r') as f:
-                template_data = json.load(f)
-                template['preview'] = template_data
-        except:
-            template['preview'] = {}
+    if query:
+        templates, total = db.search_templates(query, per_page, (page - 1) * per_page, category)
+    else:
+        templates, total = db.get_templates_page(per_page, (page - 1) * per_page, category)
+    template_library.attach_previews(templates)
 
-    return render_template('marketplace.html', templates=templates)
+    return render_template('marketplace.html', templates=templates, query=query, category=category,
+                           page=page, has_more=page * per_page < total, total=total)
 
 @app.route('/marketplace/clone/<int:template_id>')
 @login_required
 def clone_template(template_id):
-    templates = db.get_all_templates()
-    template = next((t for t in templates if t['id'] == template_id), None)
+    template = db.get_template(template_id)
 
     if not template:
         flash('Template not found.', 'danger')
         return redirect(url_for('marketplace'))
 
     try:
-        with open(f'templates_library/{template["json_file"]}', 'r') as f:
-            template_data = json.load(f)
+        template_data = template_library.get_data(template['content_hash'])
+        if template_data is None:
+            raise ValueError('template content is missing')
 
         session['clone_template'] = template_data
         db.increment_template_downloads(template_id)
@@ -459,10 +602,8 @@ def edit_template(template_id):
             description = request.form.get('description', template['description'])
             category = request.form.get('category', template['category'])
 
-            with open(f'templates_library/{template["json_file"]}', 'w') as f:
-                json.dump(template_data, f, indent=2)
-
-            db.update_template(template_id, title, description, category, template['json_file'])
+            db.update_template(template_id, title, description, category, template['json_file'], template_data)
+            template_library.register(template_id, db.template_content_hash(template_data)[0], template_data)
 
             flash('Template updated successfully!', 'success')
             return redirect(url_for('marketplace'))
@@ -471,11 +612,7 @@ def edit_template(template_id):
         except Exception as e:
             flash(f'Error updating template: {str(e)}', 'danger')
 
-    try:
-        with open(f'templates_library/{template["json_file"]}', 'r') as f:
-            template_json = json.dumps(json.load(f), indent=2)
-    except:
-        template_json = '{}'
+    template_json = json.dumps(template_library.get_data(template['content_hash']) or {}, indent=2)
 
     return render_template('edit_template.html', template=template, template_json=template_json)
 
@@ -495,8 +632,10 @@ def export_template(template_id):
         memory_file = BytesIO()
 
         with zipfile.ZipFile(memory_file, 'w', zipfile.ZIP_DEFLATED) as zf:
-            template_path = f'templates_library/{template["json_file"]}'
-            zf.write(template_path, template["json_file"])
+            template_data = template_library.get_data(template['content_hash'])
+            if template_data is None:
+                raise ValueError('template content is missing')
+            zf.writestr(template['json_file'], json.dumps(template_data, indent=2))
 
             metadata = {
                 'title': template['title'],
@@ -518,9 +657,6 @@ def export_template(template_id):
 @login_required
 def import_template():
     if request.method == 'POST':
-        import zipfile
-        from io import BytesIO
-
         if 'template_file' not in request.files:
             flash('No file uploaded.', 'danger')
             return redirect(url_for('import_template'))
@@ -536,43 +672,28 @@ def import_template():
             return redirect(url_for('import_template'))
 
         try:
-            with zipfile.ZipFile(BytesIO(file.read()), 'r') as zf:
-                file_list = zf.namelist()
-
-                if 'metadata.json' not in file_list:
-                    flash('Invalid template file: metadata.json not found.', 'danger')
-                    return redirect(url_for('import_template'))
-
-                metadata = json.loads(zf.read('metadata.json').decode('utf-8'))
-
-                template_filename = metadata.get('template_file', 'imported_template.json')
-                if template_filename not in file_list:
-                    flash(f'Template file {template_filename} not found in zip.', 'danger')
-                    return redirect(url_for('import_template'))
-
-                template_data = json.loads(zf.read(template_filename).decode('utf-8'))
-
-                import time
-                new_filename = f'imported_{int(time.time())}_{template_filename}'
-
-                with open(f'templates_library/{new_filename}', 'w') as f:
-                    json.dump(template_data, f, indent=2)
-
-                title = metadata.get('title', 'Imported Template')
-                description = metadata.get('description', 'Imported from zip file')
-                category = metadata.get('category', 'custom')
-
-                db.add_template(title, description, category, new_filename)
-
-                flash('Template imported successfully!', 'success')
-                return redirect(url_for('marketplace'))
-
-        except zipfile.BadZipFile:
-            flash('Invalid zip file.', 'danger')
-        except json.JSONDecodeError:
-            flash('Invalid JSON in template file.', 'danger')
+            # Read from werkzeug's spooled temp file rather than pulling the upload into memory
+            results = db.add_templates(template_bundle_reader.read(file.stream))
+        except BundleError as e:
+            flash(str(e), 'danger')
+            return render_template('import_template.html')
         except Exception as e:
             flash(f'Error importing template: {str(e)}', 'danger')
+            return render_template('import_template.html')
+
+        added = [result for result in results if not result['duplicate']]
+        for result in added:
+            template_library.register(result['template_id'], result['content_hash'], result['data'])
+
+        if len(results) == 1 and not added:
+            flash(f'This template is already in the library as "{results[0]["title"]}".', 'info')
+        elif len(results) == 1:
+            flash('Template imported successfully!', 'success')
+        elif len(added) < len(results):
+            flash(f'Imported {len(added)} of {len(results)} templates; the rest were already in the library.', 'success')
+        else:
+            flash(f'Imported {len(added)} templates successfully!', 'success')
+        return redirect(url_for('marketplace'))
 
     return render_template('import_template.html')
 
@@ -592,20 +713,19 @@ def apply_template_to_bot(bot_id, template_id):
         return redirect(url_for('bot_detail', bot_id=bot_id))
 
     try:
-        with open(f'templates_library/{template["json_file"]}', 'r') as f:
-            template_data = json.load(f)
+        template_data = template_library.get_data(template['content_hash'])
+        if template_data is None:
+            raise ValueError('template content is missing')
 
-        db.apply_template_to_bot(bot_id, template['json_file'])
+        # Remember AI chatbot settings so the webhook routes free text to the AI pipeline
+        bot_config = json.loads(bot['bot_config']) if bot['bot_config'] else {}
+        template_settings = template_data.get('settings', {})
+        if template_data.get('bot_type') == 'ai_chatbot' or template_settings.get('ai_enabled'):
+            bot_config['ai_chatbot'] = template_settings
+        else:
+            bot_config.pop('ai_chatbot', None)
 
-        if 'commands' in template_data:
-            for cmd in template_data['commands']:
-                db.add_bot_command(
-                    bot_id,
-                    cmd.get('command', ''),
-                    cmd.get('response_type', 'text'),
-                    cmd.get('response_content', ''),
-                    cmd.get('url_link')
-                )
+        db.replace_bot_commands(bot_id, template_data.get('commands', []), json.dumps(bot_config))
 
         flash(f'Template "{template["title"]}" applied successfully!', 'success')
         return redirect(url_for('bot_detail', bot_id=bot_id))
@@ -666,8 +786,8 @@ def ton_wallet_settings():
             flash('TON wallet address is required.', 'danger')
             return redirect(url_for('ton_wallet_settings'))
 
-        if not ((ton_wallet_address.startswith('UQ') or ton_wallet_address.startswith('EQ')) and len(ton_wallet_address) == 48):
-            flash('Invalid TON wallet address format. Must start with UQ or EQ and be exactly 48 characters.', 'danger')
+        if not ton_payment.validate_address(ton_wallet_address):
+            flash('Invalid TON wallet address. It must be a 48-character EQ/UQ address with a valid checksum.', 'danger')
             return redirect(url_for('ton_wallet_settings'))
 
         conn = db.get_connection()
@@ -725,7 +845,96 @@ def ton_wallet_settings():
                          user=user, 
                          mining_bots=[dict(bot) for bot in mining_bots],
                          total_players=total_players,
-                         total_payments_count=total_payments_count)
+                         total_payments_count=total_payments_count,
+                         payout_batches=db.get_payout_batches(session['user_id']))
+
+@app.route('/ton-wallet/payouts', methods=['POST'])
+@login_required
+def create_payout_batches():
+    """Group every pending withdrawal of the owner's mining bots into payout batches"""
+    batch_size = int(os.environ.get('PAYOUT_BATCH_SIZE', 1000))
+
+    conn = db.get_connection()
+    cursor = conn.cursor()
+    cursor.execute('SELECT id, bot_config FROM bots WHERE user_id = ? AND bot_type = ?', (session['user_id'], 'mining'))
+    mining_bots = cursor.fetchall()
+    conn.close()
+
+    batch_ids = []
+    for bot in mining_bots:
+        bot_config = json.loads(bot['bot_config']) if bot['bot_config'] else {}
+        pay_from = bot_config.get('owner_ton_wallet', '').strip()
+        if not pay_from:
+            continue
+        exchange_rate = bot_config.get('mining_settings', {}).get('withdrawal_exchange_rate', 1000000)
+        batch_ids.extend(db.create_payout_batches(bot['id'], pay_from, exchange_rate, batch_size))
+
+    if batch_ids:
+        flash(f'✅ Created {len(batch_ids)} payout batch(es). Download the manifests to send the payouts.', 'success')
+    else:
+        flash('No pending withdrawals to pay out.', 'info')
+    return redirect(url_for('ton_wallet_settings'))
+
+@app.route('/ton-wallet/payouts/<int:batch_id>.<fmt>')
+@login_required
+def export_payout_batch(batch_id, fmt):
+    """Stream a payout manifest as CSV (address,amount,comment) or JSON with per-row ton:// links"""
+    batch = db.get_payout_batch(batch_id)
+    if not batch or batch['user_id'] != session['user_id'] or fmt not in ('csv', 'json'):
+        flash('Payout batch not found.', 'danger')
+        return redirect(url_for('ton_wallet_settings'))
+
+    def generate_csv():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(['address', 'amount', 'comment'])
+        for item in db.iter_payout_items(batch_id):
+            writer.writerow([item['wallet_address'], f"{item['payout_nano'] / NANOTONS_PER_TON:.9f}", item['payout_comment']])
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+
+    def generate_json():
+        header = {
+            'batch_id': batch['id'],
+            'bot_id': batch['bot_id'],
+            'pay_from': batch['pay_from'],
+            'status': batch['status'],
+            'item_count': batch['item_count'],
+            'total_ton': batch['total_nano'] / NANOTONS_PER_TON
+        }
+        yield json.dumps(header)[:-1] + ', "items": ['
+        for index, item in enumerate(db.iter_payout_items(batch_id)):
+            amount = item['payout_nano'] / NANOTONS_PER_TON
+            yield (', ' if index else '') + json.dumps({
+                'withdrawal_id': item['id'],
+                'address': item['wallet_address'],
+                'amount_ton': amount,
+                'amount_nano': item['payout_nano'],
+                'comment': item['payout_comment'],
+                'status': item['status'],
+                'payment_link': ton_payment.create_payment_link(item['wallet_address'], amount, item['payout_comment'])
+            })
+        yield ']}'
+
+    generate = generate_csv if fmt == 'csv' else generate_json
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/json'
+    return Response(stream_with_context(generate()), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename=payout_batch_{batch_id}.{fmt}'})
+
+@app.route('/ton-wallet/payouts/<int:batch_id>/sent', methods=['POST'])
+@login_required
+def mark_payout_batch_sent(batch_id):
+    batch = db.get_payout_batch(batch_id)
+    if not batch or batch['user_id'] != session['user_id']:
+        flash('Payout batch not found.', 'danger')
+        return redirect(url_for('ton_wallet_settings'))
+
+    confirmed = db.mark_payout_batch_sent(batch_id)
+    flash(f'Batch #{batch_id} marked as sent. {confirmed} payout(s) already confirmed on-chain; '
+          'the rest are confirmed as the TON watcher indexes your wallet.', 'success')
+    return redirect(url_for('ton_wallet_settings'))
 
 @app.route('/api/ai/generate-response', methods=['POST'])
 @login_required
@@ -741,6 +950,42 @@ def api_ai_generate():
 
     return jsonify({'success': True, 'response': response})
 
+@app.route('/api/ai/generate-responses', methods=['POST'])
+@login_required
+def api_ai_generate_bulk():
+    """Stream AI suggestions for all of a bot's commands as NDJSON, one line per command"""
+    data = request.get_json() or {}
+    bot = db.get_bot(data.get('bot_id'))
+
+    if not bot or bot['user_id'] != session['user_id']:
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 403
+
+    if not ai_assistant.is_available():
+        return jsonify({'success': False, 'error': 'AI features require Gemini API key'})
+
+    # Ids often arrive as strings (DOM data attributes), so coerce before comparing with cmd['id']
+    try:
+        raw_ids = data.get('command_ids') or []
+        if not isinstance(raw_ids, list):
+            raise TypeError
+        command_ids = {int(command_id) for command_id in raw_ids}
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'error': 'command_ids must be a list of integers'}), 400
+    commands = [
+        cmd for cmd in db.get_bot_commands(bot['id'])
+        if cmd['response_type'] != 'url' and (not command_ids or cmd['id'] in command_ids)
+    ]
+    names = {cmd['id']: cmd['command'] for cmd in commands}
+    jobs = [(cmd['id'], cmd['command'], (cmd['response_content'] or '')[:300]) for cmd in commands]
+
+    def generate():
+        for command_id, suggestion in ai_assistant.suggest_command_responses(jobs):
+            yield json.dumps({'command_id': command_id, 'command': names[command_id], 'response': suggestion}) + '\n'
+        yield json.dumps({'done': True, 'count': len(jobs)}) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/api/crypto/price/<coin_id>')
 def api_crypto_price(coin_id):
     price_data = crypto_api.get_crypto_price(coin_id)
@@ -752,8 +997,51 @@ def api_crypto_price(coin_id):
 
 @app.route('/api/templates')
 def api_templates():
-    templates = db.get_all_templates()
-    return jsonify(templates)
+    page = max(1, request.args.get('page', 1, type=int))
+    limit = max(1, min(request.args.get('limit', 50, type=int), 100))
+    category = request.args.get('category') or None
+
+    templates, total = db.get_templates_page(limit, (page - 1) * limit, category)
+    return jsonify({'templates': templates, 'page': page, 'limit': limit, 'total': total,
+                    'has_more': page * limit < total})
+
+@app.route('/api/templates/<int:template_id>/rate', methods=['POST'])
+@login_required
+def rate_template(template_id):
+    data = request.get_json(silent=True) or request.form
+    try:
+        rating = int(data.get('rating', 0))
+    except (TypeError, ValueError):
+        rating = 0
+    if not 1 <= rating <= 5:
+        return jsonify({'error': 'rating must be a whole number from 1 to 5'}), 400
+
+    if not db.get_template(template_id):
+        return jsonify({'error': 'Template not found'}), 404
+
+    review = (data.get('review') or '').strip()[:1000] or None
+    totals = db.rate_template(template_id, session['user_id'], rating, review)
+    return jsonify({
+        'success': True,
+        'rating': round(totals['rating'], 2),
+        'average': round(totals['rating_sum'] / totals['rating_count'], 2),
+        'rating_count': totals['rating_count']
+    })
+
+@app.route('/api/templates/search')
+def api_search_templates():
+    """Full-text search over template titles, descriptions, categories and command text, best match first"""
+    query = request.args.get('q', '').strip()
+    page = max(1, request.args.get('page', 1, type=int))
+    limit = max(1, min(request.args.get('limit', 20, type=int), 100))
+    category = request.args.get('category') or None
+
+    if not query:
+        return jsonify({'error': 'q is required'}), 400
+
+    templates, total = db.search_templates(query, limit, (page - 1) * limit, category)
+    return jsonify({'query': query, 'templates': templates, 'page': page, 'limit': limit, 'total': total,
+                    'has_more': page * limit < total})
 
 @app.route('/api/bots')
 @login_required
@@ -824,6 +1112,12 @@ def webhook(bot_id):
         # Extract command (remove leading /)
         command = text.lstrip('/').split()[0].lower() if text.startswith('/') else None
 
+        # Route free text to a command through the bot's intent table
+        bot_config = json.loads(bot['bot_config']) if bot['bot_config'] else {}
+        if not command and bot_config.get('intents'):
+            intent_matcher = get_matcher(bot_config['intents'])
+            command = intent_matcher.command_for(intent_matcher.match(text))
+
         # Get bot token (already retrieved above)
         # telegram_api already initialized above
 
@@ -874,6 +1168,27 @@ Click "Start Mining" to launch the game! 👇'''
         commands = db.get_bot_commands(bot_id)
         response_sent = False
 
+        # AI chatbots answer free text through the background reply pipeline
+        ai_settings = bot_config.get('ai_chatbot')
+        if not command and (ai_settings or bot.get('bot_type') == 'ai_chatbot'):
+            ai_settings = ai_settings or {}
+            static = {cmd['command'].lower(): cmd['response_content'] for cmd in commands}
+            fallback = static.get('chat') or static.get('help') or "🤖 I'm a bit busy right now. Please try again in a moment."
+
+            queued = ai_replies.submit(
+                bot_id, chat_id, text,
+                send=lambda reply: telegram_api.send_message(chat_id, reply),
+                fallback=fallback,
+                max_length=ai_settings.get('max_response_length'),
+                remember=ai_settings.get('context_memory', True),
+                typing=lambda: telegram_api.send_chat_action(chat_id, 'typing')
+            )
+            if not queued:
+                telegram_api.send_message(chat_id, fallback)
+
+            db.increment_bot_messages(bot_id)
+            return jsonify({'ok': True})
+
         for cmd in commands:
             if cmd['command'].lower() == command:
                 # Special handling for menu command - show interactive buttons
@@ -1130,8 +1445,8 @@ def mining_settings(bot_id):
             owner_ton_wallet = request.form.get('owner_ton_wallet', '').strip()
 
             # Validate TON wallet if provided
-            if owner_ton_wallet and not ((owner_ton_wallet.startswith('UQ') or owner_ton_wallet.startswith('EQ')) and len(owner_ton_wallet) == 48):
-                flash('Invalid TON wallet address format. Must start with UQ or EQ and be 48 characters.', 'danger')
+            if owner_ton_wallet and not ton_payment.validate_address(owner_ton_wallet):
+                flash('Invalid TON wallet address. It must be a 48-character EQ/UQ address with a valid checksum.', 'danger')
                 return redirect(url_for('mining_settings', bot_id=bot_id))
 
             bot_config['owner_ton_wallet'] = owner_ton_wallet
@@ -1199,8 +1514,102 @@ def mining_settings(bot_id):
 
     shop_items = db.get_bot_shop_items(bot_id)
     tasks_config = db.get_bot_tasks_config(bot_id)
-    players = db.get_bot_players(bot_id)
-    return render_template('mining_settings.html', bot=bot, settings=mining_settings, owner_ton_wallet=owner_ton_wallet, shop_items=shop_items, tasks_config=tasks_config, players=players)
+    return render_template('mining_settings.html', bot=bot, settings=mining_settings, owner_ton_wallet=owner_ton_wallet, shop_items=shop_items, tasks_config=tasks_config)
+
+@app.route('/bot/<int:bot_id>/players')
+@login_required
+def bot_players(bot_id):
+    """JSON player list for the settings page: keyset pages, prefix search and filters"""
+    bot = db.get_bot(bot_id)
+    if not bot or bot['user_id'] != session['user_id']:
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 403
+
+    limit = max(1, min(request.args.get('limit', 50, type=int), 200))
+
+    after = None
+    if request.args.get('cursor'):
+        try:
+            coins, player_id = request.args['cursor'].split(',')
+            after = (float(coins), int(player_id))
+        except ValueError:
+            return jsonify({'success': False, 'error': 'Invalid cursor'}), 400
+
+    def flag(name):
+        value = request.args.get(name, '')
+        return None if value == '' else value in ('1', 'true')
+
+    players = db.search_bot_players(bot_id, limit + 1, after, request.args.get('q'),
+                                    flag('banned'), flag('has_wallet'))
+    next_cursor = None
+    if len(players) > limit:
+        players = players[:limit]
+        next_cursor = f"{players[-1]['coins']!r},{players[-1]['id']}"
+
+    return jsonify({'success': True, 'players': players, 'next_cursor': next_cursor})
+
+@app.route('/bot/<int:bot_id>/players/balances', methods=['POST'])
+@login_required
+def bot_player_balances(bot_id):
+    bot = db.get_bot(bot_id)
+    if not bot or bot['user_id'] != session['user_id']:
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 403
+
+    addresses = (request.get_json() or {}).get('addresses', [])[:200]
+    balances, pending = ton_payment.get_balances(addresses)
+    return jsonify({'success': True, 'balances': balances, 'pending': pending})
+
+@app.route('/bot/<int:bot_id>/players/bulk', methods=['POST'])
+@login_required
+def bulk_player_action(bot_id):
+    """Ban, unban or gift coins to a list of players, a CSV of ids or the top N, in one transaction"""
+    bot = db.get_bot(bot_id)
+    if not bot or bot['user_id'] != session['user_id']:
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 403
+
+    data = request.get_json(silent=True) or request.form
+    action = data.get('action')
+    id_type = data.get('id_type', 'telegram')
+    note = data.get('note', '')
+
+    try:
+        amount = float(data.get('amount') or 0)
+        top = int(data.get('top') or 0)
+
+        ids = data.get('ids') or []
+        if isinstance(ids, str):
+            ids = ids.replace(',', ' ').split()
+        upload = request.files.get('file')
+        if upload:
+            # Take the first numeric cell of every row, so header rows and extra columns are skipped
+            for row in csv.reader(io.TextIOWrapper(upload.stream, encoding='utf-8', errors='replace')):
+                cell = next((value.strip() for value in row if value.strip().isdigit()), None)
+                if cell:
+                    ids.append(cell)
+        ids = [int(value) for value in ids]
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'error': 'Invalid amount, top or ids'}), 400
+
+    if action not in ('ban', 'unban', 'gift'):
+        return jsonify({'success': False, 'error': 'Action must be ban, unban or gift'}), 400
+    if action == 'gift' and amount <= 0:
+        return jsonify({'success': False, 'error': 'Invalid amount'}), 400
+    if not top and not ids:
+        return jsonify({'success': False, 'error': 'No players selected'}), 400
+    if max(top, len(ids)) > 100000:
+        return jsonify({'success': False, 'error': 'At most 100000 players per request'}), 400
+
+    results = db.bulk_update_players(
+        bot_id, action,
+        player_ids=ids if id_type == 'player' else None,
+        telegram_ids=ids if id_type != 'player' and not top else None,
+        top=top or None, amount=amount, note=note
+    )
+    leaderboards.invalidate(bot_id)
+
+    summary = {status: 0 for status in ('ok', 'unchanged', 'not_found')}
+    for result in results:
+        summary[result['status']] += 1
+    return jsonify({'success': True, 'action': action, 'summary': summary, 'results': results})
 
 @app.route('/bot/<int:bot_id>/toggle-ban', methods=['POST'])
 @login_required
@@ -1235,11 +1644,34 @@ def send_coins_to_player(bot_id):
         if amount <= 0:
             return jsonify({'success': False, 'error': 'Invalid amount'}), 400
 
-        db.add_coins_to_player(player_id, bot_id, amount, note)
+        leaderboards.update_player(db.add_coins_to_player(player_id, bot_id, amount, note))
         return jsonify({'success': True})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/bot/<int:bot_id>/player/<int:player_id>/coin-history')
+@login_required
+def player_coin_history(bot_id, player_id):
+    bot = db.get_bot(bot_id)
+    if not bot or bot['user_id'] != session['user_id']:
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 403
+
+    conn = db.get_connection()
+    cursor = conn.cursor()
+    cursor.execute('SELECT coins FROM mining_players WHERE id = ? AND bot_id = ?', (player_id, bot_id))
+    player = cursor.fetchone()
+    conn.close()
+    if not player:
+        return jsonify({'success': False, 'error': 'Player not found'}), 404
+
+    limit = min(request.args.get('limit', 50, type=int), 500)
+    return jsonify({
+        'success': True,
+        'coins': player['coins'],
+        'ledger_balance': db.get_ledger_balance(player_id),
+        'history': db.get_coin_history(player_id, limit)
+    })
+
 @app.route('/bot/<int:bot_id>/send-ton', methods=['POST'])
 @login_required
 def send_ton_to_player(bot_id):
@@ -1284,8 +1716,8 @@ def send_ton_to_player(bot_id):
             owner_ton_wallet = request.form.get('owner_ton_wallet', '').strip()
 
             # Validate TON wallet if provided
-            if owner_ton_wallet and not ((owner_ton_wallet.startswith('UQ') or owner_ton_wallet.startswith('EQ')) and len(owner_ton_wallet) == 48):
-                flash('Invalid TON wallet address format. Must start with UQ or EQ and be 48 characters.', 'danger')
+            if owner_ton_wallet and not ton_payment.validate_address(owner_ton_wallet):
+                flash('Invalid TON wallet address. It must be a 48-character EQ/UQ address with a valid checksum.', 'danger')
                 return redirect(url_for('mining_settings', bot_id=bot_id))
 
             bot_config['owner_ton_wallet'] = owner_ton_wallet
@@ -1353,8 +1785,7 @@ def send_ton_to_player(bot_id):
 
     shop_items = db.get_bot_shop_items(bot_id)
     tasks_config = db.get_bot_tasks_config(bot_id)
-    players = db.get_bot_players(bot_id)
-    return render_template('mining_settings.html', bot=bot, settings=mining_settings, owner_ton_wallet=owner_ton_wallet, shop_items=shop_items, tasks_config=tasks_config, players=players)
+    return render_template('mining_settings.html', bot=bot, settings=mining_settings, owner_ton_wallet=owner_ton_wallet, shop_items=shop_items, tasks_config=tasks_config)
 
 @app.route('/bot/<int:bot_id>/shop-items', methods=['POST'])
 @login_required
@@ -1604,6 +2035,7 @@ def mining_tap():
         energy_cost = 1
 
         player = db.update_mining_player_tap(player_id, coins_to_add, energy_cost)
+        leaderboards.update_player(player)
 
         return jsonify({
             'success': True,
@@ -1657,6 +2089,8 @@ def mining_boost():
 
         boost_config = boost_configs[boost_type]
         result = db.purchase_boost(player_id, boost_type, boost_config['cost'], boost_config['effects'])
+        if result['success']:
+            leaderboards.update_player(result['player'])
 
         return jsonify(result)
     except Exception as e:
@@ -1711,17 +2145,20 @@ def mining_daily_reward():
             INSERT INTO mining_daily_rewards (player_id, claimed_at, reward_amount, streak_days)
             VALUES (?, DATE('now'), ?, ?)
         ''', (player_id, reward_amount, streak))
+        reward_id = cursor.lastrowid
 
         cursor.execute('''
             UPDATE mining_players SET coins = coins + ?
             WHERE id = ?
         ''', (reward_amount, player_id))
+        db.add_ledger_entries(cursor, [(player_id, reward_amount, 'daily_reward', reward_id)])
 
         conn.commit()
 
         cursor.execute('SELECT * FROM mining_players WHERE id = ?', (player_id,))
         updated_player = cursor.fetchone()
         conn.close()
+        leaderboards.update_player(dict(updated_player))
 
         return jsonify({
             'success': True,
@@ -1758,14 +2195,19 @@ def mining_shop_purchase():
             price = shop_item['price']
             currency = shop_item['currency']
             item_name = shop_item['item_name']
+            reward_type = shop_item['reward_type'] or 'coins'
         else:
             # Legacy support
             if 'amount' not in data or 'price' not in data:
                 return jsonify({'success': False, 'error': 'Missing amount or price parameters'}), 400
             amount = int(data['amount'])
             price = float(data['price'])
+            # Purchases are now credited automatically, so the client may not pick its own price
+            if LEGACY_COIN_PACKS.get(amount) != price:
+                return jsonify({'success': False, 'error': 'Unknown coin pack'}), 400
             currency = 'TON'
             item_name = f"{amount} coins"
+            reward_type = 'coins'
 
         player_id = db.validate_game_session(session_token)
         if not player_id:
@@ -1786,7 +2228,7 @@ def mining_shop_purchase():
                 'error': '⚠️ Shop Unavailable: The bot owner needs to configure their TON wallet address to accept payments. Please contact @{} to enable the shop.'.format(bot.get('bot_username', 'bot_owner'))
             }), 400
 
-        if not ((owner_ton_wallet.startswith('UQ') or owner_ton_wallet.startswith('EQ')) and len(owner_ton_wallet) == 48):
+        if not ton_payment.validate_address(owner_ton_wallet):
             return jsonify({
                 'success': False, 
                 'error': '⚠️ Shop Configuration Error: Invalid TON wallet address. Please contact the bot owner.'
@@ -1802,30 +2244,35 @@ def mining_shop_purchase():
             conn.close()
             return jsonify({'success': False, 'error': 'Please connect your TON wallet first'}), 400
 
-        # Create payment link for user to pay
-        from utils.ton_payment import TONPayment
-        ton_payment = TONPayment()
+        conn.close()
+
+        if price <= 0:
+            return jsonify({'success': False, 'error': 'Invalid item price'}), 400
 
-        payment_link = ton_payment.create_payment_link(
-            owner_ton_wallet, 
-            price, 
-            f"BotForge Mining - {item_name}"
+        # The intent nonce goes in the transfer comment so the watcher can credit it
+        intent = db.create_payment_intent(
+            bot_id, player_id, 'shop_purchase', owner_ton_wallet,
+            int(round(price * NANOTONS_PER_TON)), reward_type, amount,
+            shop_item_id=shop_item_id,
+            ttl_minutes=int(os.environ.get('PAYMENT_INTENT_TTL', 30))
         )
 
+        payment_link = ton_payment.create_payment_link(owner_ton_wallet, price, intent['nonce'])
+
         if not payment_link:
-            conn.close()
             return jsonify({'success': False, 'error': 'Invalid payment configuration'}), 400
 
-        conn.close()
-
         # Return payment link for user to complete payment
         return jsonify({
             'success': False,
             'requires_payment': True,
             'payment_link': payment_link,
+            'intent_id': intent['id'],
+            'comment': intent['nonce'],
+            'expires_at': intent['expires_at'],
             'amount': amount,
             'price': price,
-            'message': 'Please complete payment via TON wallet'
+            'message': f'Please complete payment for {item_name} via TON wallet'
         })
     except Exception as e:
         print(f"Shop purchase error: {e}")
@@ -1848,7 +2295,7 @@ def mining_wallet_connect():
 
         # Validate TON wallet address format
         if wallet_type == 'ton' and wallet_address:
-            if not (wallet_address.startswith('UQ') or wallet_address.startswith('EQ')) or len(wallet_address) != 48:
+            if not ton_payment.validate_address(wallet_address):
                 return jsonify({'success': False, 'error': 'Invalid TON wallet address'}), 400
 
         conn = db.get_connection()
@@ -1936,16 +2383,18 @@ def mining_wallet_withdraw():
 
         # Log the withdrawal transaction
         cursor.execute('''
-            INSERT INTO mining_withdrawals (player_id, amount, fee, net_amount, wallet_address, status)
-            VALUES (?, ?, ?, ?, ?, 'pending')
-        ''', (player_id, amount, fee, net_amount, wallet['wallet_address']))
+            INSERT INTO mining_withdrawals (player_id, amount, fee, net_amount, ton_amount, wallet_address, status)
+            VALUES (?, ?, ?, ?, ?, ?, 'pending')
+        ''', (player_id, amount, fee, net_amount, ton_amount, wallet['wallet_address']))
 
         withdrawal_id = cursor.lastrowid
+        db.add_ledger_entries(cursor, [(player_id, -amount, 'withdrawal', withdrawal_id)])
         conn.commit()
 
         cursor.execute('SELECT * FROM mining_players WHERE id = ?', (player_id,))
         updated_player = cursor.fetchone()
         conn.close()
+        leaderboards.update_player(dict(updated_player))
 
         return jsonify({
             'success': True,
@@ -1964,6 +2413,7 @@ def mining_wallet_withdraw():
 
 @app.route('/api/mining/wallet/deposit', methods=['POST'])
 def mining_wallet_deposit():
+    """Create a pending deposit; coins are credited once the TON watcher sees the payment"""
     try:
         data = request.json
         if not data or 'session_token' not in data or 'amount' not in data:
@@ -1971,7 +2421,6 @@ def mining_wallet_deposit():
 
         session_token = data['session_token']
         amount = float(data['amount'])
-        transaction_hash = data.get('transaction_hash', '')
 
         player_id = db.validate_game_session(session_token)
         if not player_id:
@@ -1982,31 +2431,94 @@ def mining_wallet_deposit():
 
         conn = db.get_connection()
         cursor = conn.cursor()
+        cursor.execute('SELECT bot_id FROM mining_players WHERE id = ?', (player_id,))
+        player = cursor.fetchone()
+        conn.close()
 
-        # Add coins to player account
-        cursor.execute('UPDATE mining_players SET coins = coins + ? WHERE id = ?', (amount, player_id))
+        if not player:
+            return jsonify({'success': False, 'error': 'Player not found'}), 404
 
-        # Log the deposit
-        cursor.execute('''
-            INSERT INTO mining_deposits (player_id, amount, transaction_hash, status)
-            VALUES (?, ?, ?, 'completed')
-        ''', (player_id, amount, transaction_hash))
+        bot = db.get_bot(player['bot_id'])
+        bot_config = json.loads(bot['bot_config']) if bot and bot['bot_config'] else {}
+        owner_ton_wallet = bot_config.get('owner_ton_wallet', '').strip()
+        exchange_rate = bot_config.get('mining_settings', {}).get('withdrawal_exchange_rate', 1000000)
 
-        conn.commit()
+        if not ton_payment.validate_address(owner_ton_wallet):
+            return jsonify({'success': False, 'error': 'Deposits are not available for this bot yet'}), 400
 
-        cursor.execute('SELECT * FROM mining_players WHERE id = ?', (player_id,))
-        updated_player = cursor.fetchone()
-        conn.close()
+        ton_amount = round(amount / exchange_rate, 9)
+        deposit_id, nonce = db.create_pending_deposit(player_id, amount, ton_amount, owner_ton_wallet)
+        payment_link = ton_payment.create_payment_link(owner_ton_wallet, ton_amount, nonce)
 
         return jsonify({
             'success': True,
+            'requires_payment': True,
+            'deposit_id': deposit_id,
+            'payment_link': payment_link,
+            'comment': nonce,
             'amount': amount,
-            'player': dict(updated_player)
+            'ton_amount': ton_amount,
+            'message': 'Send the payment with the exact comment. Coins are credited once it is confirmed.'
         })
     except Exception as e:
         print(f"Deposit error: {e}")
         return jsonify({'success': False, 'error': 'Deposit failed'}), 500
 
+@app.route('/api/mining/wallet/deposit/<int:deposit_id>')
+def mining_wallet_deposit_status(deposit_id):
+    try:
+        player_id = db.validate_game_session(request.args.get('session_token', ''))
+        if not player_id:
+            return jsonify({'success': False, 'error': 'Invalid session'}), 401
+
+        deposit = db.get_player_deposit(deposit_id, player_id)
+        if not deposit:
+            return jsonify({'success': False, 'error': 'Deposit not found'}), 404
+
+        return jsonify({
+            'success': True,
+            'status': deposit['status'],
+            'amount': deposit['amount'],
+            'transaction_hash': deposit['transaction_hash']
+        })
+    except Exception as e:
+        print(f"Deposit status error: {e}")
+        return jsonify({'success': False, 'error': 'Failed to load deposit'}), 500
+
+@app.route('/api/mining/payments/<int:intent_id>')
+def mining_payment_status(intent_id):
+    try:
+        player_id = db.validate_game_session(request.args.get('session_token', ''))
+        if not player_id:
+            return jsonify({'success': False, 'error': 'Invalid session'}), 401
+
+        intent = db.get_player_payment_intent(intent_id, player_id)
+        if not intent:
+            return jsonify({'success': False, 'error': 'Payment not found'}), 404
+
+        response = {
+            'success': True,
+            'status': intent['status'],
+            'reward_type': intent['reward_type'],
+            'reward_amount': intent['reward_amount'],
+            'expires_at': intent['expires_at'],
+            'transaction_hash': intent['transaction_hash']
+        }
+
+        if intent['status'] == 'completed':
+            conn = db.get_connection()
+            cursor = conn.cursor()
+            cursor.execute('SELECT coins, energy FROM mining_players WHERE id = ?', (player_id,))
+            player = cursor.fetchone()
+            conn.close()
+            if player:
+                response['player'] = {'coins': player['coins'], 'energy': player['energy']}
+
+        return jsonify(response)
+    except Exception as e:
+        print(f"Payment status error: {e}")
+        return jsonify({'success': False, 'error': 'Failed to load payment'}), 500
+
 @app.route('/api/mining/tasks')
 def mining_tasks():
     try:
@@ -2047,26 +2559,65 @@ def mining_tasks():
 @app.route('/api/mining/leaderboard')
 def mining_leaderboard():
     try:
-        bot_id = request.args.get('bot_id')
-        limit = request.args.get('limit', 10)
+        bot_id = request.args.get('bot_id', type=int)
+        limit = max(1, request.args.get('limit', 10, type=int))
 
         if not bot_id:
             return jsonify({'success': False, 'error': 'Missing bot_id'}), 400
 
-        bot = db.get_bot(bot_id)
-        if not bot or not bot['is_active']:
+        snapshot = leaderboards.snapshot(bot_id, limit)
+        if not snapshot:
             return jsonify({'success': False, 'error': 'Bot not found or inactive'}), 404
 
-        leaderboard = db.get_mining_leaderboard(bot_id, limit=limit)
-
-        return jsonify({
-            'success': True,
-            'leaderboard': leaderboard
-        })
+        body, etag = snapshot
+        response = Response(body, mimetype='application/json')
+        response.set_etag(etag)
+        response.cache_control.public = True
+        response.cache_control.max_age = int(leaderboards.snapshot_ttl)
+        return response.make_conditional(request)
     except Exception as e:
         print(f"Leaderboard error: {e}")
         return jsonify({'success': False, 'error': 'Failed to load leaderboard'}), 500
 
+@app.route('/api/mining/rank')
+def mining_rank():
+    try:
+        bot_id = request.args.get('bot_id', type=int)
+        session_token = request.args.get('session_token')
+        around = max(0, min(request.args.get('around', 5, type=int), 25))
+
+        if not bot_id or not session_token:
+            return jsonify({'success': False, 'error': 'Missing parameters'}), 400
+
+        player_id = db.validate_game_session(session_token)
+        if not player_id:
+            return jsonify({'success': False, 'error': 'Invalid session'}), 401
+
+        board = leaderboards.get(bot_id)
+        if not board:
+            return jsonify({'success': False, 'error': 'Bot not found or inactive'}), 404
+
+        if player_id not in board:
+            # Joined after the board was seeded
+            conn = db.get_connection()
+            cursor = conn.cursor()
+            cursor.execute('SELECT * FROM mining_players WHERE id = ? AND bot_id = ?', (player_id, bot_id))
+            player = cursor.fetchone()
+            conn.close()
+            if not player:
+                return jsonify({'success': False, 'error': 'Player not found'}), 404
+            leaderboards.update_player(dict(player))
+
+        result = board.rank(player_id, around)
+        if not result:
+            return jsonify({'success': False, 'error': 'Player not found'}), 404
+
+        result['success'] = True
+        return jsonify(result)
+    except Exception as e:
+        print(f"Rank error: {e}")
+        return jsonify({'success': False, 'error': 'Failed to load rank'}), 500
+
 if __name__ == '__main__':
     # Use environment variable for production or default to development
     port = int(os.environ.get('PORT', 5000))
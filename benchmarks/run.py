@@ -0,0 +1,228 @@
+"""Request benchmarks against a freshly seeded temporary database.
+
+    python -m benchmarks.run --sizes 1000,10000,100000 --output benchmarks/latest.json
+    python -m benchmarks.run --baseline benchmarks/baseline.json --fail-on-regression 15
+
+Every scenario goes through the Flask test client, so numbers are in-process
+handler cost (routing, SQL, JSON) without a real HTTP server in front.
+Outbound Telegram/CoinGecko/toncenter calls go to the local stub server.
+"""
+import argparse
+import importlib
+import json
+import math
+import os
+import platform
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime
+
+from benchmarks.seed import FIRST_TELEGRAM_ID, MINING_BOT_TOKEN, grow_players, reset_energy, seed_account, signed_init_data
+from utils.stub_server import start_stub_server, stub_environment
+
+SCENARIOS = ('tap', 'init', 'webhook_command', 'webhook_menu', 'webhook_callback', 'leaderboard', 'dashboard')
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def measure(client, build_request, requests, warmup):
+    """Run one scenario; ``build_request(i)`` returns ``(method, path, kwargs)``"""
+    for i in range(warmup):
+        method, path, kwargs = build_request(i)
+        client.open(path, method=method, **kwargs).get_data()
+
+    latencies = []
+    statuses = Counter()
+    started = time.perf_counter()
+    for i in range(warmup, warmup + requests):
+        method, path, kwargs = build_request(i)
+        request_started = time.perf_counter()
+        response = client.open(path, method=method, **kwargs)
+        response.get_data()
+        latencies.append(time.perf_counter() - request_started)
+        statuses[response.status_code] += 1
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    ms = [value * 1000 for value in latencies]
+    return {
+        'requests': requests,
+        'seconds': round(elapsed, 4),
+        'rps': round(requests / elapsed, 1) if elapsed else 0.0,
+        'mean_ms': round(sum(ms) / len(ms), 3),
+        'p50_ms': round(percentile(ms, 50), 3),
+        'p90_ms': round(percentile(ms, 90), 3),
+        'p95_ms': round(percentile(ms, 95), 3),
+        'p99_ms': round(percentile(ms, 99), 3),
+        'max_ms': round(ms[-1], 3),
+        'statuses': {str(status): count for status, count in sorted(statuses.items())},
+        'errors': sum(count for status, count in statuses.items() if status >= 400)
+    }
+
+
+def build_scenarios(app_module, account, size, tap_players=50, init_users=200):
+    db = app_module.db
+    mining_bot_id = account['mining_bot_id']
+    command_bot_id = account['command_bot_id']
+
+    conn = db.get_connection()
+    player_ids = [row[0] for row in conn.execute(
+        'SELECT id FROM mining_players WHERE bot_id = ? ORDER BY id LIMIT ?', (mining_bot_id, tap_players))]
+    conn.close()
+    tokens = []
+    for player_id in player_ids:
+        token = f'bench-{size}-{player_id}'
+        db.create_game_session(player_id, token)
+        tokens.append(token)
+
+    # Spread logins over the whole table; signing happens here, outside the timed loop
+    init_data = []
+    for n in range(init_users):
+        index = (n * 7919) % size
+        init_data.append(signed_init_data(MINING_BOT_TOKEN, FIRST_TELEGRAM_ID + index, f'player{index}', f'Player {index}'))
+
+    command_texts = ['/help', '/about', '/faq', '/profile']
+    command_ids = account['command_ids']
+
+    def message(i, text):
+        user = {'id': FIRST_TELEGRAM_ID + i % 1000, 'first_name': 'Bench', 'username': f'bench{i % 1000}', 'language_code': 'en'}
+        return {'update_id': i, 'message': {'message_id': i, 'chat': {'id': user['id'], 'type': 'private'}, 'from': user, 'text': text}}
+
+    return {
+        'tap': lambda i: ('POST', '/api/mining/tap', {'json': {'session_token': tokens[i % len(tokens)], 'bot_id': mining_bot_id}}),
+        'init': lambda i: ('GET', '/api/mining/init', {'query_string': {'bot_id': mining_bot_id, 'init_data': init_data[i % len(init_data)]}}),
+        'webhook_command': lambda i: ('POST', f'/webhook/{command_bot_id}', {'json': message(i, command_texts[i % len(command_texts)])}),
+        'webhook_menu': lambda i: ('POST', f'/webhook/{command_bot_id}', {'json': message(i, '/menu')}),
+        'webhook_callback': lambda i: ('POST', f'/webhook/{command_bot_id}', {'json': {
+            'update_id': i,
+            'callback_query': {
+                'id': f'cb{i}',
+                'data': f'cmd_{command_ids[i % len(command_ids)]}',
+                'message': {'message_id': i, 'chat': {'id': FIRST_TELEGRAM_ID + i % 1000, 'type': 'private'}}
+            }
+        }}),
+        'leaderboard': lambda i: ('GET', f'/api/mining/leaderboard?bot_id={mining_bot_id}&limit=100', {}),
+        'dashboard': lambda i: ('GET', '/dashboard', {})
+    }
+
+
+def compare(results, baseline, threshold):
+    """Print p95/throughput changes against a baseline run; returns the regressions"""
+    regressions = []
+    print(f"\n{'size':>8} {'scenario':<18} {'p95 ms':>10} {'base':>10} {'change':>8} {'rps':>9} {'base':>9}")
+    for size, scenarios in results['results'].items():
+        for name, current in scenarios.items():
+            previous = baseline.get('results', {}).get(size, {}).get(name)
+            if not previous:
+                continue
+            change = (current['p95_ms'] - previous['p95_ms']) / previous['p95_ms'] * 100 if previous['p95_ms'] else 0.0
+            marker = ''
+            if threshold is not None and change > threshold:
+                regressions.append({'size': size, 'scenario': name, 'p95_change_pct': round(change, 1)})
+                marker = '  REGRESSION'
+            print(f"{size:>8} {name:<18} {current['p95_ms']:>10.3f} {previous['p95_ms']:>10.3f} {change:>+7.1f}% "
+                  f"{current['rps']:>9.1f} {previous['rps']:>9.1f}{marker}")
+    return regressions
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the hot request paths against a seeded temporary database')
+    parser.add_argument('--sizes', default='1000,10000,50000', help='comma-separated mining player counts, run in ascending order')
+    parser.add_argument('--requests', type=int, default=300, help='timed requests per scenario and size')
+    parser.add_argument('--warmup', type=int, default=20)
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help=f'subset of {",".join(SCENARIOS)}')
+    parser.add_argument('--stub-latency', type=int, default=0, help='latency in ms added by the stub to every outbound API call')
+    parser.add_argument('--output', default='benchmarks/latest.json')
+    parser.add_argument('--baseline', help='earlier --output file to compare against')
+    parser.add_argument('--fail-on-regression', type=float, metavar='PCT',
+                        help='exit with status 1 when any p95 is more than PCT percent above the baseline')
+    parser.add_argument('--keep', action='store_true', help='keep the seeded database and metrics directory afterwards')
+    args = parser.parse_args()
+
+    sizes = sorted(int(size) for size in args.sizes.split(','))
+    scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f'unknown scenarios: {", ".join(sorted(unknown))}')
+
+    workdir = tempfile.mkdtemp(prefix='bot-bench-')
+    try:
+        _, stub_url = start_stub_server(latency_ms=args.stub_latency)
+        os.environ.update(stub_environment(stub_url))
+        os.environ['DATABASE_PATH'] = os.path.join(workdir, 'bench.db')
+        os.environ['METRICS_DIR'] = os.path.join(workdir, 'metrics')
+        os.environ.setdefault('TONCENTER_RPS', '1000')
+        os.environ['TONCENTER_RATE_FILE'] = os.path.join(workdir, 'toncenter-rate')
+
+        # The app reads its configuration at import time, so import only once the environment is set
+        app_module = importlib.import_module('app')
+        client = app_module.app.test_client()
+        account = seed_account(app_module.db)
+        with client.session_transaction() as session:
+            session['user_id'] = account['user_id']
+            session['username'] = 'bench_owner'
+
+        results = {
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'git_commit': git_commit(),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'config': {'sizes': sizes, 'requests': args.requests, 'warmup': args.warmup, 'stub_latency_ms': args.stub_latency},
+            'results': {}
+        }
+
+        for size in sizes:
+            seed_started = time.perf_counter()
+            grow_players(app_module.db, account['mining_bot_id'], size)
+            reset_energy(app_module.db, account['mining_bot_id'])
+            app_module.leaderboards.invalidate(account['mining_bot_id'])
+            print(f"\n{size} players (seeded in {time.perf_counter() - seed_started:.1f}s)")
+
+            builders = build_scenarios(app_module, account, size)
+            results['results'][str(size)] = {}
+            for name in scenarios:
+                stats = measure(client, builders[name], args.requests, args.warmup)
+                results['results'][str(size)][name] = stats
+                errors = f"  ({stats['errors']} errors: {stats['statuses']})" if stats['errors'] else ''
+                print(f"  {name:<18} {stats['rps']:>8.1f} req/s  p50 {stats['p50_ms']:>8.3f}  "
+                      f"p95 {stats['p95_ms']:>8.3f}  p99 {stats['p99_ms']:>8.3f} ms{errors}")
+
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nWrote {args.output}")
+
+        if args.baseline:
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+            regressions = compare(results, baseline, args.fail_on_regression)
+            if regressions and args.fail_on_regression is not None:
+                print(f"\n{len(regressions)} scenario(s) regressed by more than {args.fail_on_regression}%")
+                sys.exit(1)
+    finally:
+        if args.keep:
+            print(f"Kept {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+import hashlib
+import hmac
+import json
+import time
+from urllib.parse import urlencode
+
+MINING_BOT_TOKEN = '700000001:bench-mining-token'
+COMMAND_BOT_TOKEN = '700000002:bench-command-token'
+FIRST_TELEGRAM_ID = 5_000_000
+
+
+def seed_account(db):
+    """Owner account with a telegram command bot and an active mining bot"""
+    user_id, _ = db.create_user('bench_owner', 'bench-password')
+
+    commands = [
+        ('start', 'text', 'Welcome!'),
+        ('help', 'text', 'Available commands: /menu /about /faq'),
+        ('menu', 'text', 'Pick a command below.'),
+        ('profile', 'text', 'User ID: {user_id}\nName: {name}\nUsername: @{username}'),
+        ('about', 'text', 'A benchmark bot.'),
+        ('faq', 'text', 'Q: Is this a benchmark?\nA: Yes.')
+    ] + [(f'extra{i}', 'text', f'Extra command {i}') for i in range(14)]
+    command_bot_id = db.create_bot(user_id, 'Bench Commands', COMMAND_BOT_TOKEN, json.dumps({'commands': [], 'bot_type': 'telegram'}),
+                                   'telegram', bot_username='bench_commands_bot', commands=commands)
+
+    mining_config = {'mining_settings': {'withdrawal_exchange_rate': 1000, 'min_withdrawal': 100}}
+    mining_bot_id = db.create_bot(user_id, 'Bench Mining', MINING_BOT_TOKEN, json.dumps(mining_config),
+                                  'mining', bot_username='bench_mining_bot')
+
+    conn = db.get_connection()
+    conn.execute('UPDATE bots SET is_active = 1 WHERE id IN (?, ?)', (command_bot_id, mining_bot_id))
+    conn.commit()
+    conn.close()
+
+    return {
+        'user_id': user_id,
+        'command_bot_id': command_bot_id,
+        'mining_bot_id': mining_bot_id,
+        'command_ids': [command['id'] for command in db.get_bot_commands(command_bot_id)]
+    }
+
+
+def grow_players(db, bot_id, target, batch_size=5000):
+    """Add mining players until the bot has ``target`` of them; returns the count added"""
+    conn = db.get_connection()
+    cursor = conn.cursor()
+    cursor.execute('SELECT COUNT(*) FROM mining_players WHERE bot_id = ?', (bot_id,))
+    existing = cursor.fetchone()[0]
+
+    for start in range(existing, target, batch_size):
+        end = min(start + batch_size, target)
+        cursor.executemany('''
+            INSERT INTO mining_players (bot_id, telegram_user_id, username, first_name, coins, total_taps, level)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', [
+            (bot_id, FIRST_TELEGRAM_ID + i, f'player{i}', f'Player {i}', (i * 7919) % 1_000_000, i % 5000, 1 + i % 10)
+            for i in range(start, end)
+        ])
+        conn.commit()
+
+    conn.close()
+    return max(0, target - existing)
+
+
+def reset_energy(db, bot_id):
+    conn = db.get_connection()
+    conn.execute('UPDATE mining_players SET energy = energy_max WHERE bot_id = ?', (bot_id,))
+    conn.commit()
+    conn.close()
+
+
+def signed_init_data(bot_token, telegram_user_id, username, first_name):
+    """Telegram WebApp init_data, signed the way validate_telegram_webapp_data checks it"""
+    fields = {
+        'auth_date': str(int(time.time())),
+        'query_id': f'bench{telegram_user_id}',
+        'user': json.dumps({'id': telegram_user_id, 'username': username, 'first_name': first_name}, separators=(',', ':'))
+    }
+    data_check_string = '\n'.join(f'{key}={value}' for key, value in sorted(fields.items()))
+    secret_key = hmac.new(b'WebAppData', bot_token.encode(), hashlib.sha256).digest()
+    fields['hash'] = hmac.new(secret_key, data_check_string.encode(), hashlib.sha256).hexdigest()
+    return urlencode(fields)
@@ -0,0 +1,134 @@
+import os
+import tempfile
+import unittest
+
+from utils.database import Database
+from utils.ton_watcher import TONWatcher
+
+WALLET = 'EQ-owner-wallet'
+
+
+class FakeTon:
+    """getTransactions over an in-memory history, newest first"""
+
+    def __init__(self):
+        self.history = []
+
+    def add(self, count):
+        start = self.history[0]['transaction_id']['lt'] + 1 if self.history else 1
+        for lt in range(start, start + count):
+            self.history.insert(0, {
+                'transaction_id': {'lt': lt, 'hash': f'h{lt}'},
+                'utime': 1700000000 + lt,
+                'in_msg': {'source': 'EQ-player', 'value': 1, 'message': f'n{lt}'}
+            })
+
+    def get_transaction_info(self, address, limit=10, lt=None, tx_hash=None):
+        start = 0
+        if lt and tx_hash:
+            start = next(i for i, tx in enumerate(self.history) if tx['transaction_id']['lt'] == int(lt))
+        return self.history[start:start + limit]
+
+
+class TONWatcherTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.tmp.name)  # Database writes .encryption_key to the working directory
+        self.db = Database(os.path.join(self.tmp.name, 'test.db'))
+        self.ton = FakeTon()
+        self.watcher = TONWatcher(self.db, ton_payment=self.ton, page_size=10, max_pages=3)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def stored_lts(self):
+        conn = self.db.get_connection()
+        lts = [row[0] for row in conn.execute('SELECT lt FROM ton_transactions WHERE wallet_address = ? ORDER BY lt', (WALLET,))]
+        conn.close()
+        return lts
+
+    def test_backlog_deeper_than_max_pages_is_resumed(self):
+        self.ton.add(5)
+        self.watcher.poll_wallet(WALLET)
+        self.assertEqual(self.db.get_ton_cursor(WALLET)['last_lt'], 5)
+
+        # 75 new transactions against 3 pages of 10 per poll
+        self.ton.add(75)
+        self.watcher.poll_wallet(WALLET)
+        cursor = self.db.get_ton_cursor(WALLET)
+        self.assertEqual(cursor['last_lt'], 5)
+        self.assertEqual(cursor['scan_top_lt'], 80)
+
+        self.ton.add(4)
+        for _ in range(5):
+            self.watcher.poll_wallet(WALLET)
+
+        self.assertEqual(self.stored_lts(), list(range(1, 85)))
+        cursor = self.db.get_ton_cursor(WALLET)
+        self.assertEqual(cursor['last_lt'], 84)
+        self.assertIsNone(cursor['scan_lt'])
+
+    def test_failed_page_keeps_cursor(self):
+        self.ton.add(5)
+        self.watcher.poll_wallet(WALLET)
+        self.ton.add(25)
+
+        fetch = self.ton.get_transaction_info
+        calls = []
+
+        def flaky(address, limit=10, lt=None, tx_hash=None):
+            calls.append(lt)
+            return [] if len(calls) == 2 else fetch(address, limit, lt, tx_hash)
+
+        self.ton.get_transaction_info = flaky
+        self.watcher.poll_wallet(WALLET)
+        self.assertEqual(self.db.get_ton_cursor(WALLET)['last_lt'], 5)
+
+        self.ton.get_transaction_info = fetch
+        self.watcher.poll_wallet(WALLET)
+        self.assertEqual(self.stored_lts(), list(range(1, 31)))
+        self.assertEqual(self.db.get_ton_cursor(WALLET)['last_lt'], 30)
+
+    def pay_intent(self, paid_offset_seconds):
+        user_id, _ = self.db.create_user('owner', 'password')
+        bot_id = self.db.create_bot(user_id, 'Mining', '1:token', '{}', 'mining')
+        player = self.db.get_or_create_mining_player(bot_id, 42)
+        intent = self.db.create_payment_intent(bot_id, player['id'], 'shop', WALLET, 1, 'coins', 100)
+
+        # The sweep runs before the payment is indexed, e.g. after failed polls
+        conn = self.db.get_connection()
+        conn.execute("UPDATE payment_intents SET expires_at = DATETIME('now', '-1 minute') WHERE id = ?", (intent['id'],))
+        conn.commit()
+        deadline = conn.execute("SELECT CAST(strftime('%s', expires_at) AS INTEGER) FROM payment_intents WHERE id = ?",
+                                (intent['id'],)).fetchone()[0]
+        conn.close()
+        self.assertEqual(self.db.expire_payment_intents(), 1)
+
+        self.db.record_ton_transactions(WALLET, [{
+            'lt': 1, 'tx_hash': 'h1', 'utime': deadline + paid_offset_seconds, 'direction': 'in', 'msg_index': 0,
+            'counterparty': 'EQ-player', 'amount_nano': 1, 'comment': intent['nonce']
+        }], 1, 'h1')
+        return self.db.get_player_payment_intent(intent['id'], player['id'])['status']
+
+    def test_payment_before_deadline_completes_expired_intent(self):
+        self.assertEqual(self.pay_intent(-30), 'completed')
+
+    def test_payment_after_deadline_is_late(self):
+        self.assertEqual(self.pay_intent(30), 'late_payment')
+
+    def test_one_transfer_verifies_one_payment(self):
+        from utils.ton_payment import TONPayment
+
+        self.db.record_ton_transactions(WALLET, [{
+            'lt': 1, 'tx_hash': 'h1', 'utime': 1700000000, 'direction': 'in', 'msg_index': 0,
+            'counterparty': 'EQ-player', 'amount_nano': 2_000_000_000, 'comment': None
+        }], 1, 'h1')
+        ton = TONPayment(db=self.db)
+        self.assertTrue(ton.verify_payment('EQ-player', WALLET, 2.0)['verified'])
+        self.assertFalse(ton.verify_payment('EQ-player', WALLET, 2.0)['verified'])
+
+
+if __name__ == '__main__':
+    unittest.main()
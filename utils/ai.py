@@ -1,20 +1,67 @@
 import os
-import google.generativeai as genai
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from utils.intents import get_matcher
 
 class AIAssistant:
     def __init__(self):
         self.api_key = os.environ.get('GEMINI_API_KEY')
-        if self.api_key:
-            genai.configure(api_key=self.api_key)
-            self.model = genai.GenerativeModel('gemini-pro')
-        else:
-            self.model = None
-    
+        self.api_base = os.environ.get('GEMINI_API_BASE')
+        self.max_workers = int(os.environ.get('AI_MAX_CONCURRENCY', 8))
+        self.load_time = None
+        self._model = None
+        self._loaded = False
+        self._lock = threading.Lock()
+        self._executor = None
+
+    @property
+    def model(self):
+        if not self._loaded:
+            self._load_model()
+        return self._model
+
+    def _load_model(self):
+        """Import google.generativeai and build the model once, on first use"""
+        with self._lock:
+            if self._loaded:
+                return
+
+            if self.api_key:
+                started = time.perf_counter()
+                try:
+                    import google.generativeai as genai
+                    if self.api_base:
+                        genai.configure(api_key=self.api_key, transport='rest',
+                                        client_options={'api_endpoint': self.api_base})
+                    else:
+                        genai.configure(api_key=self.api_key)
+                    self._model = genai.GenerativeModel('gemini-pro')
+                except Exception as e:
+                    print(f"Error loading Gemini backend: {e}")
+                else:
+                    self.load_time = time.perf_counter() - started
+                    print(f"Gemini backend loaded in {self.load_time * 1000:.1f} ms")
+
+            self._loaded = True
+
+    def _get_executor(self):
+        """Shared, bounded pool for concurrent Gemini calls"""
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='ai')
+        return self._executor
+
     def is_available(self):
+        if not self.api_key:
+            return False
         return self.model is not None
     
-    def generate_bot_response(self, user_message, context=""):
+    def generate_bot_response(self, user_message, context="", raise_errors=False):
         if not self.is_available():
+            if raise_errors:
+                raise RuntimeError('Gemini API key not configured')
             return "AI features require a Gemini API key. Please configure it in settings."
         
         try:
@@ -27,6 +74,8 @@ Generate a friendly, concise response (max 2-3 sentences):"""
             response = self.model.generate_content(prompt)
             return response.text
         except Exception as e:
+            if raise_errors:
+                raise
             return f"AI generation failed: {str(e)}"
     
     def suggest_command_response(self, command_name, command_description=""):
@@ -44,6 +93,26 @@ Generate a helpful response message (2-3 sentences max):"""
         except Exception as e:
             return self._get_default_response(command_name)
     
+    def suggest_command_responses(self, commands):
+        """Yield (key, response) for (key, command_name, description) tuples as each one completes"""
+        if not self.is_available():
+            for key, command_name, _ in commands:
+                yield key, self._get_default_response(command_name)
+            return
+
+        executor = self._get_executor()
+        futures = {
+            executor.submit(self.suggest_command_response, command_name, description): key
+            for key, command_name, description in commands
+        }
+        try:
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+        finally:
+            # Client went away: drop the generations that have not started yet
+            for future in futures:
+                future.cancel()
+    
     def _get_default_response(self, command_name):
         defaults = {
             'start': 'Welcome! I\'m here to help you. Use /help to see available commands.',
@@ -56,21 +125,11 @@ Generate a helpful response message (2-3 sentences max):"""
         }
         return defaults.get(command_name.lower(), f'Command /{command_name} executed successfully!')
     
-    def detect_intent(self, message):
-        intents = {
-            'price': ['price', 'cost', 'how much', 'value', 'worth'],
-            'buy': ['buy', 'purchase', 'get', 'acquire'],
-            'claim': ['claim', 'reward', 'airdrop', 'free'],
-            'help': ['help', 'support', 'how to', 'guide'],
-            'balance': ['balance', 'wallet', 'funds', 'money']
-        }
-        
-        message_lower = message.lower()
-        for intent, keywords in intents.items():
-            if any(keyword in message_lower for keyword in keywords):
-                return intent
-        
-        return 'general'
+    def detect_intent(self, message, intents=None):
+        return get_matcher(intents).match(message)
+
+    def detect_intents(self, messages, intents=None):
+        return get_matcher(intents).match_many(messages)
     
     def generate_bot_config(self, bot_type, bot_description=""):
         if not self.is_available():
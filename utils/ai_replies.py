@@ -0,0 +1,179 @@
+import heapq
+import itertools
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+class AIReplyPipeline:
+    """Generates AI chat replies off the request thread.
+
+    The webhook calls ``submit`` and returns straight away. Replies are
+    generated on a bounded pool with a per-bot concurrency limit; anything
+    that does not finish within ``timeout`` seconds gets the static fallback
+    instead. A timed-out job is cancelled if it hasn't started, and its slots
+    are freed either way, so a hung model call can't starve later messages.
+    The last few turns of each chat are kept in a small ring buffer and
+    passed to the model as context.
+    """
+
+    def __init__(self, ai_assistant, max_workers=None, max_pending=None, per_bot_limit=None,
+                 timeout=None, context_size=6, max_chats=5000):
+        self.ai = ai_assistant
+        self.max_workers = max_workers or int(os.environ.get('AI_REPLY_WORKERS', 8))
+        self.per_bot_limit = per_bot_limit or int(os.environ.get('AI_REPLY_PER_BOT', 4))
+        self.timeout = timeout or float(os.environ.get('AI_REPLY_TIMEOUT', 8))
+        self.context_size = context_size
+        self.max_chats = max_chats
+
+        self._pending = threading.BoundedSemaphore(max_pending or int(os.environ.get('AI_REPLY_MAX_PENDING', 200)))
+        self._bot_slots = {}
+        self._contexts = OrderedDict()
+        self._lock = threading.Lock()
+
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='ai-reply')
+        self._sender = ThreadPoolExecutor(max_workers=4, thread_name_prefix='ai-send')
+
+        self._deadlines = []
+        self._sequence = itertools.count()
+        self._deadline_cond = threading.Condition()
+        self._watchdog = None
+
+    def submit(self, bot_id, chat_id, text, send, fallback, max_length=None, remember=True, typing=None):
+        """Queue a reply for ``text``; returns False when the bot or pool is saturated.
+
+        ``send`` is called exactly once, with either the AI reply or ``fallback``.
+        ``typing``, if given, is called in the background once the job is queued.
+        """
+        if not self._pending.acquire(blocking=False):
+            return False
+
+        bot_slot = self._get_bot_slot(bot_id)
+        if not bot_slot.acquire(blocking=False):
+            self._pending.release()
+            return False
+
+        key = (bot_id, chat_id)
+        context = self._get_context(key) if remember else ''
+        job = {
+            'key': key,
+            'text': text,
+            'send': send,
+            'fallback': fallback,
+            'max_length': max_length,
+            'remember': remember,
+            'bot_slot': bot_slot,
+            'delivered': False,
+            'released': False
+        }
+
+        if typing is not None:
+            self._sender.submit(self._notify_typing, typing)
+        job['future'] = self._executor.submit(self.ai.generate_bot_response, text, context, raise_errors=True)
+        job['future'].add_done_callback(lambda f: self._on_generated(job, f))
+        self._schedule_deadline(job)
+        return True
+
+    def _get_bot_slot(self, bot_id):
+        with self._lock:
+            slot = self._bot_slots.get(bot_id)
+            if slot is None:
+                slot = threading.BoundedSemaphore(self.per_bot_limit)
+                self._bot_slots[bot_id] = slot
+            return slot
+
+    def _get_context(self, key):
+        with self._lock:
+            turns = self._contexts.get(key)
+            return '\n'.join(turns) if turns else ''
+
+    def _remember(self, key, user_text, reply):
+        with self._lock:
+            turns = self._contexts.get(key)
+            if turns is None:
+                turns = deque(maxlen=self.context_size)
+                self._contexts[key] = turns
+                while len(self._contexts) > self.max_chats:
+                    self._contexts.popitem(last=False)
+            else:
+                self._contexts.move_to_end(key)
+            turns.append(f"User: {user_text[:200]}")
+            turns.append(f"Bot: {reply[:200]}")
+
+    def _release(self, job):
+        with self._lock:
+            if job['released']:
+                return
+            job['released'] = True
+        job['bot_slot'].release()
+        self._pending.release()
+
+    def _on_generated(self, job, future):
+        self._release(job)
+        if future.cancelled():
+            return  # timed out while queued; the fallback has been sent
+
+        try:
+            reply = (future.result() or '').strip()
+        except Exception as e:
+            print(f"AI reply error: {e}")
+            reply = ''
+
+        if not reply:
+            self._deliver(job, None)
+            return
+
+        if job['max_length'] and len(reply) > job['max_length']:
+            reply = reply[:job['max_length'] - 1].rstrip() + '…'
+        self._deliver(job, reply)
+
+    def _deliver(self, job, reply):
+        with self._lock:
+            if job['delivered']:
+                return
+            job['delivered'] = True
+
+        if reply and job['remember']:
+            self._remember(job['key'], job['text'], reply)
+
+        self._sender.submit(self._send, job['send'], reply or job['fallback'])
+
+    def _send(self, send, text):
+        try:
+            send(text)
+        except Exception as e:
+            print(f"AI reply send error: {e}")
+
+    def _notify_typing(self, typing):
+        try:
+            typing()
+        except Exception as e:
+            print(f"AI reply typing error: {e}")
+
+    def _schedule_deadline(self, job):
+        with self._deadline_cond:
+            heapq.heappush(self._deadlines, (time.monotonic() + self.timeout, next(self._sequence), job))
+            if self._watchdog is None:
+                self._watchdog = threading.Thread(target=self._watch_deadlines, name='ai-reply-timeout', daemon=True)
+                self._watchdog.start()
+            self._deadline_cond.notify()
+
+    def _watch_deadlines(self):
+        """Send the fallback for every job that outlives its deadline"""
+        while True:
+            with self._deadline_cond:
+                while not self._deadlines:
+                    self._deadline_cond.wait()
+                deadline, _, job = self._deadlines[0]
+                delay = deadline - time.monotonic()
+                if delay > 0:
+                    self._deadline_cond.wait(delay)
+                    continue
+                heapq.heappop(self._deadlines)
+
+            self._deliver(job, None)
+            # Drop the job if it is still queued; a running call can't be stopped, but it stops counting
+            job['future'].cancel()
+            self._release(job)
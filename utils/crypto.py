@@ -1,9 +1,10 @@
+import os
 import requests
 from datetime import datetime
 
 class CryptoAPI:
-    def __init__(self):
-        self.coingecko_base = 'https://api.coingecko.com/api/v3'
+    def __init__(self, api_base=None):
+        self.coingecko_base = (api_base or os.environ.get('COINGECKO_API_BASE', 'https://api.coingecko.com/api/v3')).rstrip('/')
     
     def get_crypto_price(self, coin_id='bitcoin', currency='usd'):
         try:
@@ -1,12 +1,43 @@
+import hashlib
+import json
+import os
+import re
 import sqlite3
 import secrets
-from datetime import datetime
+import zlib
+from datetime import datetime, timezone
 from cryptography.fernet import Fernet
 from werkzeug.security import generate_password_hash, check_password_hash
 
+# Allowed payment intent status changes; anything else is refused
+# Lateness is judged by the transaction's utime, so an intent the sweep expired
+# before its (on-time) payment was indexed can still complete
+PAYMENT_INTENT_TRANSITIONS = {
+    'pending': {'completed', 'underpaid', 'expired', 'late_payment'},
+    'expired': {'completed', 'underpaid', 'late_payment'},
+    'underpaid': set(),
+    'completed': set(),
+    'late_payment': set()
+}
+
+# templates.rating is a Bayesian average: every template starts as if it had
+# TEMPLATE_RATING_PRIOR_COUNT ratings of TEMPLATE_RATING_PRIOR_MEAN, so a single
+# 5-star vote doesn't outrank a long track record
+TEMPLATE_RATING_PRIOR_COUNT = 5
+TEMPLATE_RATING_PRIOR_MEAN = 3.0
+
+# Per-bot datasets included in account exports, streamed row by row
+BOT_EXPORT_QUERIES = {
+    'commands': 'SELECT id, command, response_type, response_content, url_link, created_at FROM bot_commands WHERE bot_id = ? ORDER BY id',
+    'shop_items': 'SELECT * FROM mining_shop_items WHERE bot_id = ? ORDER BY id',
+    'tasks': 'SELECT * FROM mining_tasks_config WHERE bot_id = ? ORDER BY id',
+    'players': 'SELECT * FROM mining_players WHERE bot_id = ? ORDER BY id'
+}
+
 class Database:
     def __init__(self, db_path='database.db'):
         self.db_path = db_path
+        self.profiler = None  # optional utils.sql_profiler.SQLProfiler
         self.encryption_key = self._get_or_create_key()
         self.cipher = Fernet(self.encryption_key)
         self.init_db()
@@ -22,7 +53,7 @@ class Database:
             return key
 
     def get_connection(self):
-        conn = sqlite3.connect(self.db_path)
+        conn = self.profiler.connect(self.db_path) if self.profiler else sqlite3.connect(self.db_path)
         conn.row_factory = sqlite3.Row
         conn.execute('PRAGMA foreign_keys = ON')
         return conn
@@ -101,6 +132,59 @@ class Database:
             )
         ''')
 
+        # Template payloads are stored once per distinct content, zlib-compressed and keyed by sha256
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS template_blobs (
+                content_hash TEXT PRIMARY KEY,
+                data BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS template_versions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                template_id INTEGER NOT NULL,
+                version INTEGER NOT NULL,
+                content_hash TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (template_id) REFERENCES templates(id) ON DELETE CASCADE,
+                FOREIGN KEY (content_hash) REFERENCES template_blobs(content_hash),
+                UNIQUE(template_id, version)
+            )
+        ''')
+
+        # Migration: Add content columns to templates if they don't exist
+        try:
+            cursor.execute("SELECT content_hash FROM templates LIMIT 1")
+        except sqlite3.OperationalError:
+            cursor.execute("ALTER TABLE templates ADD COLUMN content_hash TEXT")
+            cursor.execute("ALTER TABLE templates ADD COLUMN version INTEGER DEFAULT 0")
+            conn.commit()
+
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_templates_content_hash ON templates(content_hash)')
+
+        # Full-text index over template metadata and command text; rowid is the template id
+        self.template_search_enabled = True
+        try:
+            cursor.execute("SELECT rowid FROM templates_fts LIMIT 1")
+        except sqlite3.OperationalError:
+            try:
+                cursor.execute('''
+                    CREATE VIRTUAL TABLE templates_fts USING fts5(
+                        title, description, category, commands,
+                        tokenize = 'unicode61 remove_diacritics 2'
+                    )
+                ''')
+                cursor.execute('SELECT id FROM templates')
+                for template in cursor.fetchall():
+                    self._index_template(cursor, template['id'])
+                conn.commit()
+            except sqlite3.OperationalError as e:
+                print(f"Template search index unavailable, falling back to LIKE: {e}")
+                self.template_search_enabled = False
+
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS analytics (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -163,6 +247,80 @@ class Database:
             )
         ''')
 
+        # Migration: Add running rating totals to templates if they don't exist
+        try:
+            cursor.execute("SELECT rating_sum FROM templates LIMIT 1")
+        except sqlite3.OperationalError:
+            cursor.execute("ALTER TABLE templates ADD COLUMN rating_sum INTEGER DEFAULT 0")
+            cursor.execute("ALTER TABLE templates ADD COLUMN rating_count INTEGER DEFAULT 0")
+            cursor.execute('''
+                UPDATE templates SET
+                    rating_sum = (SELECT COALESCE(SUM(rating), 0) FROM template_ratings WHERE template_id = templates.id),
+                    rating_count = (SELECT COUNT(rating) FROM template_ratings WHERE template_id = templates.id)
+            ''')
+            conn.commit()
+
+        # Keep the totals and the Bayesian average in step with template_ratings.
+        # Recreated on every start so changes to the prior take effect, inside one
+        # write transaction so no other worker's rating lands between drop and create.
+        bayesian = f'''(({TEMPLATE_RATING_PRIOR_COUNT} * {TEMPLATE_RATING_PRIOR_MEAN}) + rating_sum + {{delta_sum}})
+                       / ({TEMPLATE_RATING_PRIOR_COUNT} + rating_count + {{delta_count}})'''
+        conn.commit()
+        cursor.execute('BEGIN IMMEDIATE')
+        cursor.execute('DROP TRIGGER IF EXISTS template_ratings_insert')
+        cursor.execute('DROP TRIGGER IF EXISTS template_ratings_update')
+        cursor.execute('DROP TRIGGER IF EXISTS template_ratings_delete')
+        cursor.execute('DROP TRIGGER IF EXISTS templates_rating_prior')
+        cursor.execute(f'''
+            CREATE TRIGGER templates_rating_prior AFTER INSERT ON templates
+            BEGIN
+                UPDATE templates SET rating = {bayesian.format(delta_sum='0', delta_count='0')} WHERE id = NEW.id;
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER template_ratings_insert AFTER INSERT ON template_ratings
+            WHEN NEW.rating IS NOT NULL
+            BEGIN
+                UPDATE templates SET
+                    rating = {bayesian.format(delta_sum='NEW.rating', delta_count='1')},
+                    rating_sum = rating_sum + NEW.rating,
+                    rating_count = rating_count + 1
+                WHERE id = NEW.template_id;
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER template_ratings_update AFTER UPDATE OF rating, template_id ON template_ratings
+            BEGIN
+                UPDATE templates SET
+                    rating = {bayesian.format(delta_sum='-OLD.rating', delta_count='-1')},
+                    rating_sum = rating_sum - OLD.rating,
+                    rating_count = rating_count - 1
+                WHERE id = OLD.template_id AND OLD.rating IS NOT NULL;
+                UPDATE templates SET
+                    rating = {bayesian.format(delta_sum='NEW.rating', delta_count='1')},
+                    rating_sum = rating_sum + NEW.rating,
+                    rating_count = rating_count + 1
+                WHERE id = NEW.template_id AND NEW.rating IS NOT NULL;
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER template_ratings_delete AFTER DELETE ON template_ratings
+            WHEN OLD.rating IS NOT NULL
+            BEGIN
+                UPDATE templates SET
+                    rating = {bayesian.format(delta_sum='-OLD.rating', delta_count='-1')},
+                    rating_sum = rating_sum - OLD.rating,
+                    rating_count = rating_count - 1
+                WHERE id = OLD.template_id;
+            END
+        ''')
+        cursor.execute(f'''
+            UPDATE templates SET rating = {bayesian.format(delta_sum='0', delta_count='0')}
+            WHERE rating IS NOT {bayesian.format(delta_sum='0', delta_count='0')}
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_templates_popularity ON templates(downloads DESC, rating DESC, id DESC)')
+        conn.commit()
+
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS game_sessions (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -364,6 +522,158 @@ class Database:
             )
         ''')
 
+        # Migration: Add payment matching columns to mining_deposits if they don't exist
+        try:
+            cursor.execute("SELECT nonce FROM mining_deposits LIMIT 1")
+        except sqlite3.OperationalError:
+            cursor.execute("ALTER TABLE mining_deposits ADD COLUMN nonce TEXT")
+            cursor.execute("ALTER TABLE mining_deposits ADD COLUMN ton_amount REAL")
+            cursor.execute("ALTER TABLE mining_deposits ADD COLUMN pay_to TEXT")
+            conn.commit()
+
+        cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_mining_deposits_nonce ON mining_deposits(nonce)')
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS payout_batches (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                bot_id INTEGER NOT NULL,
+                pay_from TEXT NOT NULL,
+                item_count INTEGER NOT NULL,
+                total_nano INTEGER NOT NULL,
+                status TEXT DEFAULT 'batched',
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                sent_at TIMESTAMP,
+                confirmed_at TIMESTAMP,
+                FOREIGN KEY (bot_id) REFERENCES bots(id) ON DELETE CASCADE
+            )
+        ''')
+
+        # Migration: Add payout columns to mining_withdrawals if they don't exist
+        try:
+            cursor.execute("SELECT batch_id FROM mining_withdrawals LIMIT 1")
+        except sqlite3.OperationalError:
+            cursor.execute("ALTER TABLE mining_withdrawals ADD COLUMN ton_amount REAL")
+            cursor.execute("ALTER TABLE mining_withdrawals ADD COLUMN batch_id INTEGER")
+            cursor.execute("ALTER TABLE mining_withdrawals ADD COLUMN payout_nano INTEGER")
+            cursor.execute("ALTER TABLE mining_withdrawals ADD COLUMN payout_comment TEXT")
+            conn.commit()
+
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_mining_withdrawals_status ON mining_withdrawals(status, player_id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_mining_withdrawals_batch ON mining_withdrawals(batch_id, status)')
+        cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_mining_withdrawals_comment ON mining_withdrawals(payout_comment)')
+
+        # Append-only ledger of every coin balance change, plus periodic per-player snapshots
+        try:
+            cursor.execute("SELECT id FROM coin_ledger LIMIT 1")
+        except sqlite3.OperationalError:
+            cursor.execute('''
+                CREATE TABLE coin_ledger (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    player_id INTEGER NOT NULL,
+                    delta REAL NOT NULL,
+                    reason TEXT NOT NULL,
+                    ref_id INTEGER,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            # Existing balances enter the ledger as opening entries
+            cursor.execute('''
+                INSERT INTO coin_ledger (player_id, delta, reason)
+                SELECT id, coins, 'opening_balance' FROM mining_players WHERE coins != 0
+            ''')
+            conn.commit()
+
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_coin_ledger_player ON coin_ledger(player_id, id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_mining_players_coins ON mining_players(bot_id, coins)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_mining_players_banned ON mining_players(bot_id, is_banned, coins)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_mining_players_username ON mining_players(bot_id, username COLLATE NOCASE)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_mining_players_first_name ON mining_players(bot_id, first_name COLLATE NOCASE)')
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS coin_balance_snapshots (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                player_id INTEGER NOT NULL,
+                ledger_id INTEGER NOT NULL,
+                balance REAL NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_coin_snapshots_player ON coin_balance_snapshots(player_id, ledger_id)')
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS ton_transactions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                wallet_address TEXT NOT NULL,
+                lt INTEGER NOT NULL,
+                tx_hash TEXT NOT NULL,
+                direction TEXT NOT NULL,
+                msg_index INTEGER DEFAULT 0,
+                counterparty TEXT,
+                amount_nano INTEGER NOT NULL,
+                comment TEXT,
+                utime INTEGER,
+                matched_type TEXT,
+                matched_id INTEGER,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE(wallet_address, lt, direction, msg_index)
+            )
+        ''')
+
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_ton_transactions_comment ON ton_transactions(comment)')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_ton_transactions_counterparty
+            ON ton_transactions(wallet_address, direction, counterparty, amount_nano)
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_ton_transactions_hash ON ton_transactions(tx_hash)')
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS payment_intents (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                nonce TEXT NOT NULL UNIQUE,
+                bot_id INTEGER NOT NULL,
+                player_id INTEGER NOT NULL,
+                intent_type TEXT NOT NULL,
+                shop_item_id INTEGER,
+                pay_to TEXT NOT NULL,
+                amount_nano INTEGER NOT NULL,
+                reward_type TEXT DEFAULT 'coins',
+                reward_amount REAL NOT NULL,
+                status TEXT DEFAULT 'pending',
+                transaction_hash TEXT,
+                expires_at TIMESTAMP NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                paid_at TIMESTAMP,
+                FOREIGN KEY (bot_id) REFERENCES bots(id) ON DELETE CASCADE,
+                FOREIGN KEY (player_id) REFERENCES mining_players(id) ON DELETE CASCADE
+            )
+        ''')
+
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_payment_intents_status ON payment_intents(status, expires_at)')
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS ton_wallet_cursors (
+                wallet_address TEXT PRIMARY KEY,
+                last_lt INTEGER DEFAULT 0,
+                last_hash TEXT,
+                scan_lt INTEGER,
+                scan_hash TEXT,
+                scan_top_lt INTEGER,
+                scan_top_hash TEXT,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+
+        # Migration: Add catch-up paging columns to ton_wallet_cursors if they don't exist
+        try:
+            cursor.execute("SELECT scan_lt FROM ton_wallet_cursors LIMIT 1")
+        except sqlite3.OperationalError:
+            cursor.execute("ALTER TABLE ton_wallet_cursors ADD COLUMN scan_lt INTEGER")
+            cursor.execute("ALTER TABLE ton_wallet_cursors ADD COLUMN scan_hash TEXT")
+            cursor.execute("ALTER TABLE ton_wallet_cursors ADD COLUMN scan_top_lt INTEGER")
+            cursor.execute("ALTER TABLE ton_wallet_cursors ADD COLUMN scan_top_hash TEXT")
+            conn.commit()
+
         conn.commit()
         conn.close()
 
@@ -413,18 +723,20 @@ class Database:
         conn.close()
         return dict(user) if user else None
 
-    def create_bot(self, user_id, bot_name, bot_token, bot_config, bot_type='telegram'):
+    def create_bot(self, user_id, bot_name, bot_token, bot_config, bot_type='telegram', bot_username=None, commands=()):
+        """Insert a bot together with its username and starting commands in one transaction"""
         conn = self.get_connection()
         cursor = conn.cursor()
 
         encrypted_token = self.encrypt_token(bot_token) if bot_token else ''
 
         cursor.execute(
-            'INSERT INTO bots (user_id, bot_name, bot_token, bot_config, bot_type) VALUES (?, ?, ?, ?, ?)',
-            (user_id, bot_name, encrypted_token, bot_config, bot_type)
+            'INSERT INTO bots (user_id, bot_name, bot_token, bot_config, bot_type, bot_username) VALUES (?, ?, ?, ?, ?, ?)',
+            (user_id, bot_name, encrypted_token, bot_config, bot_type, bot_username)
         )
-        conn.commit()
         bot_id = cursor.lastrowid
+        self._insert_bot_commands(cursor, bot_id, commands)
+        conn.commit()
         conn.close()
         return bot_id
 
@@ -461,18 +773,236 @@ class Database:
         conn.close()
         return [dict(template) for template in templates]
 
-    def add_template(self, title, description, category, json_file):
+    def add_template(self, title, description, category, json_file, data=None):
         conn = self.get_connection()
         cursor = conn.cursor()
         cursor.execute(
             'INSERT INTO templates (title, description, category, json_file) VALUES (?, ?, ?, ?)',
             (title, description, category, json_file)
         )
-        conn.commit()
         template_id = cursor.lastrowid
+        if data is not None:
+            self._add_template_version(cursor, template_id, data)
+        self._index_template(cursor, template_id, data)
+        conn.commit()
         conn.close()
         return template_id
 
+    def add_templates(self, templates):
+        """Insert ``(title, description, category, json_file, data)`` items in one transaction.
+
+        ``templates`` may be a generator; it is consumed inside the transaction
+        and anything it raises rolls the whole batch back. Content already in
+        the library (or earlier in the batch) is not added again.
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        results = []
+        try:
+            for title, description, category, json_file, data in templates:
+                content_hash = self.template_content_hash(data)[0]
+                cursor.execute('SELECT id, title FROM templates WHERE content_hash = ? ORDER BY id LIMIT 1', (content_hash,))
+                existing = cursor.fetchone()
+                if existing:
+                    results.append({'template_id': existing['id'], 'title': existing['title'],
+                                    'content_hash': content_hash, 'duplicate': True})
+                    continue
+
+                cursor.execute(
+                    'INSERT INTO templates (title, description, category, json_file) VALUES (?, ?, ?, ?)',
+                    (title, description, category, json_file)
+                )
+                template_id = cursor.lastrowid
+                self._add_template_version(cursor, template_id, data)
+                self._index_template(cursor, template_id, data)
+                results.append({'template_id': template_id, 'title': title, 'content_hash': content_hash,
+                                'duplicate': False, 'data': data})
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        return results
+
+    @staticmethod
+    def template_content_hash(data):
+        """sha256 of the canonical JSON encoding, so key order and whitespace don't matter"""
+        encoded = json.dumps(data, sort_keys=True, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+        return hashlib.sha256(encoded).hexdigest(), encoded
+
+    def _store_template_blob(self, cursor, data):
+        content_hash, encoded = self.template_content_hash(data)
+        cursor.execute(
+            'INSERT OR IGNORE INTO template_blobs (content_hash, data, size) VALUES (?, ?, ?)',
+            (content_hash, zlib.compress(encoded, 9), len(encoded))
+        )
+        return content_hash
+
+    def _add_template_version(self, cursor, template_id, data):
+        """Point a template at ``data``, recording a new version unless the content is unchanged"""
+        content_hash = self._store_template_blob(cursor, data)
+        cursor.execute('SELECT content_hash, version FROM templates WHERE id = ?', (template_id,))
+        current = cursor.fetchone()
+        if current['content_hash'] == content_hash:
+            return content_hash
+
+        version = (current['version'] or 0) + 1
+        cursor.execute(
+            'INSERT INTO template_versions (template_id, version, content_hash) VALUES (?, ?, ?)',
+            (template_id, version, content_hash)
+        )
+        cursor.execute('UPDATE templates SET content_hash = ?, version = ? WHERE id = ?', (content_hash, version, template_id))
+        return content_hash
+
+    def _index_template(self, cursor, template_id, data=None):
+        """Refresh a template's full-text row; ``data`` is loaded from its blob when not given"""
+        if not getattr(self, 'template_search_enabled', False):
+            return
+        cursor.execute('''
+            SELECT t.title, t.description, t.category, b.data
+            FROM templates t LEFT JOIN template_blobs b ON b.content_hash = t.content_hash
+            WHERE t.id = ?
+        ''', (template_id,))
+        template = cursor.fetchone()
+        cursor.execute('DELETE FROM templates_fts WHERE rowid = ?', (template_id,))
+        if not template:
+            return
+        if data is None and template['data'] is not None:
+            data = json.loads(zlib.decompress(template['data']).decode('utf-8'))
+
+        commands = (data or {}).get('commands') or []
+        command_text = '\n'.join(
+            f"{cmd.get('command', '')} {cmd.get('response_content') or ''}" for cmd in commands if isinstance(cmd, dict)
+        )
+        cursor.execute(
+            'INSERT INTO templates_fts (rowid, title, description, category, commands) VALUES (?, ?, ?, ?, ?)',
+            (template_id, template['title'], template['description'] or '', template['category'] or '', command_text)
+        )
+
+    def get_templates_page(self, limit=50, offset=0, category=None):
+        """One page of templates in marketplace order, plus the total count"""
+        where, params = ('WHERE category = ?', [category]) if category else ('', [])
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(f'SELECT COUNT(*) FROM templates {where}', params)
+        total = cursor.fetchone()[0]
+        cursor.execute(f'''
+            SELECT * FROM templates {where}
+            ORDER BY downloads DESC, rating DESC, id DESC
+            LIMIT ? OFFSET ?
+        ''', params + [limit, offset])
+        templates = [dict(template) for template in cursor.fetchall()]
+        conn.close()
+        return templates, total
+
+    def search_templates(self, query, limit=20, offset=0, category=None):
+        """Rank templates against ``query`` (prefix match on every word), plus the total hit count"""
+        words = re.findall(r'\w+', query.lower())[:10]
+        if not words:
+            return [], 0
+
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        if self.template_search_enabled:
+            match = ' '.join(f'"{word}"*' for word in words)
+            category_filter, params = ('AND t.category = ?', [category]) if category else ('', [])
+            cursor.execute(f'''
+                SELECT COUNT(*) FROM templates_fts f JOIN templates t ON t.id = f.rowid
+                WHERE templates_fts MATCH ? {category_filter}
+            ''', [match] + params)
+            total = cursor.fetchone()[0]
+            # bm25 weights: title, description, category, commands
+            cursor.execute(f'''
+                SELECT t.*, bm25(templates_fts, 10.0, 5.0, 2.0, 1.0) AS score
+                FROM templates_fts f JOIN templates t ON t.id = f.rowid
+                WHERE templates_fts MATCH ? {category_filter}
+                ORDER BY score, t.downloads DESC, t.id DESC
+                LIMIT ? OFFSET ?
+            ''', [match] + params + [limit, offset])
+        else:
+            conditions = ' AND '.join('(title LIKE ? OR description LIKE ?)' for _ in words)
+            params = [f'%{word}%' for word in words for _ in range(2)]
+            if category:
+                conditions += ' AND category = ?'
+                params.append(category)
+            cursor.execute(f'SELECT COUNT(*) FROM templates WHERE {conditions}', params)
+            total = cursor.fetchone()[0]
+            cursor.execute(f'''
+                SELECT * FROM templates WHERE {conditions}
+                ORDER BY downloads DESC, rating DESC, id DESC
+                LIMIT ? OFFSET ?
+            ''', params + [limit, offset])
+        templates = [dict(template) for template in cursor.fetchall()]
+        conn.close()
+        return templates, total
+
+    def get_template_payloads(self, content_hashes):
+        """Decoded template JSON for each hash found, as a dict keyed by hash"""
+        content_hashes = list(set(content_hashes))
+        payloads = {}
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        for start in range(0, len(content_hashes), 500):
+            chunk = content_hashes[start:start + 500]
+            cursor.execute(
+                f'SELECT content_hash, data FROM template_blobs WHERE content_hash IN ({",".join("?" * len(chunk))})',
+                chunk
+            )
+            for row in cursor.fetchall():
+                payloads[row['content_hash']] = json.loads(zlib.decompress(row['data']).decode('utf-8'))
+        conn.close()
+        return payloads
+
+    def get_template_versions(self, template_id):
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT v.version, v.content_hash, v.created_at, b.size
+            FROM template_versions v
+            JOIN template_blobs b ON b.content_hash = v.content_hash
+            WHERE v.template_id = ?
+            ORDER BY v.version DESC
+        ''', (template_id,))
+        versions = cursor.fetchall()
+        conn.close()
+        return [dict(version) for version in versions]
+
+    def migrate_template_files(self, directory):
+        """Copy the JSON file of every template without stored content into the database"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT id, json_file FROM templates WHERE content_hash IS NULL')
+        migrated = 0
+        for template in cursor.fetchall():
+            try:
+                with open(os.path.join(directory, template['json_file']), 'r') as f:
+                    data = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"Template migration skipped {template['json_file']}: {e}")
+                continue
+            self._add_template_version(cursor, template['id'], data)
+            self._index_template(cursor, template['id'], data)
+            migrated += 1
+        conn.commit()
+        conn.close()
+        return migrated
+
+    def rate_template(self, template_id, user_id, rating, review=None):
+        """Record or replace a user's rating; the triggers update the template's totals"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT INTO template_ratings (template_id, user_id, rating, review) VALUES (?, ?, ?, ?)
+            ON CONFLICT(template_id, user_id) DO UPDATE SET rating = excluded.rating, review = excluded.review,
+                created_at = CURRENT_TIMESTAMP
+        ''', (template_id, user_id, rating, review))
+        cursor.execute('SELECT rating, rating_sum, rating_count FROM templates WHERE id = ?', (template_id,))
+        template = dict(cursor.fetchone())
+        conn.commit()
+        conn.close()
+        return template
+
     def increment_template_downloads(self, template_id):
         conn = self.get_connection()
         cursor = conn.cursor()
@@ -488,7 +1018,7 @@ class Database:
         conn.close()
         return dict(template) if template else None
 
-    def update_template(self, template_id, title, description, category, json_file):
+    def update_template(self, template_id, title, description, category, json_file, data=None):
         conn = self.get_connection()
         cursor = conn.cursor()
         cursor.execute('''
@@ -496,8 +1026,12 @@ class Database:
             SET title = ?, description = ?, category = ?, json_file = ?
             WHERE id = ?
         ''', (title, description, category, json_file, template_id))
-        conn.commit()
         updated = cursor.rowcount > 0
+        if updated and data is not None:
+            self._add_template_version(cursor, template_id, data)
+        if updated:
+            self._index_template(cursor, template_id, data)
+        conn.commit()
         conn.close()
         return updated
 
@@ -505,18 +1039,55 @@ class Database:
         conn = self.get_connection()
         cursor = conn.cursor()
         cursor.execute('DELETE FROM templates WHERE id = ?', (template_id,))
-        conn.commit()
         deleted = cursor.rowcount > 0
+        if self.template_search_enabled:
+            cursor.execute('DELETE FROM templates_fts WHERE rowid = ?', (template_id,))
+        conn.commit()
         conn.close()
         return deleted
 
-    def apply_template_to_bot(self, bot_id, template_json_file):
+    @staticmethod
+    def _insert_bot_commands(cursor, bot_id, commands):
+        """executemany insert; commands are template-style dicts or (command, type, content[, url]) tuples"""
+        rows = []
+        for cmd in commands:
+            if isinstance(cmd, dict):
+                rows.append((bot_id, cmd.get('command', ''), cmd.get('response_type', 'text'),
+                             cmd.get('response_content', ''), cmd.get('url_link')))
+            else:
+                command, response_type, response_content = cmd[:3]
+                rows.append((bot_id, command, response_type, response_content, cmd[3] if len(cmd) > 3 else None))
+        cursor.executemany(
+            'INSERT INTO bot_commands (bot_id, command, response_type, response_content, url_link) VALUES (?, ?, ?, ?, ?)',
+            rows
+        )
+        return len(rows)
+
+    def add_bot_commands(self, bot_id, commands):
         conn = self.get_connection()
         cursor = conn.cursor()
-        cursor.execute('DELETE FROM bot_commands WHERE bot_id = ?', (bot_id,))
+        added = self._insert_bot_commands(cursor, bot_id, commands)
         conn.commit()
         conn.close()
-        return True
+        return added
+
+    def replace_bot_commands(self, bot_id, commands, bot_config=None):
+        """Swap a bot's whole command set (and optionally its config) atomically"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute('BEGIN IMMEDIATE')
+            cursor.execute('DELETE FROM bot_commands WHERE bot_id = ?', (bot_id,))
+            added = self._insert_bot_commands(cursor, bot_id, commands)
+            if bot_config is not None:
+                cursor.execute('UPDATE bots SET bot_config = ? WHERE id = ?', (bot_config, bot_id))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        return added
 
     def add_bot_command(self, bot_id, command, response_type, response_content, url_link=None):
         conn = self.get_connection()
@@ -634,6 +1205,7 @@ class Database:
                 last_tap_time = CURRENT_TIMESTAMP
             WHERE id = ?
         ''', (coins_to_add, energy_cost, player_id))
+        self.add_ledger_entries(cursor, [(player_id, coins_to_add, 'tap', None)])
 
         conn.commit()
 
@@ -683,6 +1255,7 @@ class Database:
             return {'success': False, 'error': 'Insufficient coins'}
 
         cursor.execute('UPDATE mining_players SET coins = coins - ? WHERE id = ?', (cost, player_id))
+        self.add_ledger_entries(cursor, [(player_id, -cost, f'boost:{boost_type}', None)])
 
         update_fields = []
         update_values = []
@@ -724,6 +1297,17 @@ class Database:
         conn.close()
         return [dict(entry) for entry in leaderboard]
 
+    def get_leaderboard_seed(self, bot_id):
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT id, username, first_name, coins, level, total_taps
+            FROM mining_players WHERE bot_id = ?
+        ''', (bot_id,))
+        rows = cursor.fetchall()
+        conn.close()
+        return rows
+
     def activate_bot(self, bot_id, webhook_url):
         conn = self.get_connection()
         cursor = conn.cursor()
@@ -872,11 +1456,12 @@ class Database:
             conn.commit()
         
         cursor.execute('''
-            SELECT id, telegram_user_id, username, first_name, coins, level, 
-                   COALESCE(is_banned, 0) as is_banned
-            FROM mining_players 
-            WHERE bot_id = ?
-            ORDER BY coins DESC
+            SELECT mp.id, mp.telegram_user_id, mp.username, mp.first_name, mp.coins, mp.level, 
+                   COALESCE(mp.is_banned, 0) as is_banned, mw.wallet_address
+            FROM mining_players mp
+            LEFT JOIN mining_wallets mw ON mw.player_id = mp.id
+            WHERE mp.bot_id = ?
+            ORDER BY mp.coins DESC
             LIMIT ?
         ''', (bot_id, limit))
         players = cursor.fetchall()
@@ -910,14 +1495,150 @@ class Database:
             SET coins = coins + ?
             WHERE id = ? AND bot_id = ?
         ''', (amount, player_id, bot_id))
-        
+        if not cursor.rowcount:
+            conn.close()
+            return
+
         # Log the transaction
         cursor.execute('''
             INSERT INTO mining_admin_transactions (player_id, transaction_type, amount, note)
             VALUES (?, 'coins_gift', ?, ?)
         ''', (player_id, amount, note))
+        self.add_ledger_entries(cursor, [(player_id, amount, 'admin_gift', cursor.lastrowid)])
+        conn.commit()
+
+        cursor.execute('SELECT * FROM mining_players WHERE id = ?', (player_id,))
+        player = cursor.fetchone()
+        conn.close()
+        return dict(player) if player else None
+
+    def search_bot_players(self, bot_id, limit=50, after=None, query=None, banned=None, has_wallet=None):
+        """One page of a bot's players, richest first, with keyset pagination.
+
+        ``after`` is the ``(coins, id)`` of the last row of the previous page.
+        ``query`` is a case-insensitive prefix of username or first name (a
+        leading @ is ignored), or an exact Telegram user id when numeric.
+        """
+        conditions = ['mp.bot_id = ?']
+        params = [bot_id]
+
+        if after:
+            conditions.append('(mp.coins, mp.id) < (?, ?)')
+            params.extend(after)
+
+        if banned is not None:
+            conditions.append('mp.is_banned = ?')
+            params.append(1 if banned else 0)
+
+        if has_wallet is not None:
+            conditions.append(f"{'' if has_wallet else 'NOT '}EXISTS (SELECT 1 FROM mining_wallets w "
+                              "WHERE w.player_id = mp.id AND w.wallet_address IS NOT NULL AND w.wallet_address != '')")
+
+        query = (query or '').strip().lstrip('@')
+        if query.isdigit():
+            conditions.append('mp.telegram_user_id = ?')
+            params.append(int(query))
+        elif query:
+            # Range scans on the NOCASE indexes instead of LIKE '%...%' over every row
+            upper = query + '\U0010ffff'
+            # Written as an id subquery so the planner picks the name indexes over the coins index
+            conditions.append('''mp.id IN (
+                SELECT id FROM mining_players
+                WHERE bot_id = ? AND username >= ? COLLATE NOCASE AND username < ? COLLATE NOCASE
+                UNION ALL
+                SELECT id FROM mining_players
+                WHERE bot_id = ? AND first_name >= ? COLLATE NOCASE AND first_name < ? COLLATE NOCASE
+            )''')
+            params.extend([bot_id, query, upper, bot_id, query, upper])
+
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            SELECT mp.id, mp.telegram_user_id, mp.username, mp.first_name, mp.coins, mp.level,
+                   COALESCE(mp.is_banned, 0) as is_banned,
+                   (SELECT w.wallet_address FROM mining_wallets w WHERE w.player_id = mp.id) as wallet_address
+            FROM mining_players mp
+            WHERE {' AND '.join(conditions)}
+            ORDER BY mp.coins DESC, mp.id DESC
+            LIMIT ?
+        ''', params + [limit])
+        players = cursor.fetchall()
+        conn.close()
+        return [dict(player) for player in players]
+
+    def bulk_update_players(self, bot_id, action, player_ids=None, telegram_ids=None, top=None,
+                            amount=0, note=''):
+        """Ban, unban or gift coins to many players of one bot in a single transaction.
+
+        Targets are player ids, Telegram user ids or the ``top`` N unbanned
+        players by coins. Returns one ``{'id', 'player_id', 'status'}`` row per
+        requested target, where status is ``ok``, ``unchanged`` or ``not_found``.
+        """
+        if action not in ('ban', 'unban', 'gift'):
+            raise ValueError(f'Unknown bulk action: {action}')
+
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+
+        # Resolve the targets to this bot's players, in request order
+        found = {}
+        if top:
+            cursor.execute('''
+                SELECT id, id as lookup, COALESCE(is_banned, 0) as is_banned FROM mining_players
+                WHERE bot_id = ? AND COALESCE(is_banned, 0) = 0
+                ORDER BY coins DESC, id DESC LIMIT ?
+            ''', (bot_id, top))
+            rows = cursor.fetchall()
+            requested = [row['id'] for row in rows]
+            found = {row['lookup']: row for row in rows}
+        else:
+            column = 'telegram_user_id' if telegram_ids is not None else 'id'
+            requested = list(dict.fromkeys(telegram_ids if telegram_ids is not None else player_ids or []))
+            for start in range(0, len(requested), 500):
+                chunk = requested[start:start + 500]
+                cursor.execute(f'''
+                    SELECT id, {column} as lookup, COALESCE(is_banned, 0) as is_banned FROM mining_players
+                    WHERE bot_id = ? AND {column} IN ({','.join('?' * len(chunk))})
+                ''', [bot_id] + chunk)
+                found.update((row['lookup'], row) for row in cursor.fetchall())
+
+        results = []
+        changed = []
+        for lookup in requested:
+            row = found.get(lookup)
+            if row is None:
+                results.append({'id': lookup, 'player_id': None, 'status': 'not_found'})
+            elif action != 'gift' and bool(row['is_banned']) == (action == 'ban'):
+                results.append({'id': lookup, 'player_id': row['id'], 'status': 'unchanged'})
+            else:
+                results.append({'id': lookup, 'player_id': row['id'], 'status': 'ok'})
+                changed.append(row['id'])
+
+        if changed:
+            if action == 'gift':
+                cursor.executemany('UPDATE mining_players SET coins = coins + ? WHERE id = ?',
+                                   [(amount, player_id) for player_id in changed])
+            else:
+                cursor.executemany('UPDATE mining_players SET is_banned = ? WHERE id = ?',
+                                   [(1 if action == 'ban' else 0, player_id) for player_id in changed])
+
+            transaction_type = 'coins_gift' if action == 'gift' else action
+            cursor.executemany('''
+                INSERT INTO mining_admin_transactions (player_id, transaction_type, amount, note)
+                VALUES (?, ?, ?, ?)
+            ''', [(player_id, transaction_type, amount if action == 'gift' else 0, note) for player_id in changed])
+
+            if action == 'gift':
+                # Nothing else can write inside BEGIN IMMEDIATE, so the new rows have consecutive ids
+                cursor.execute('SELECT last_insert_rowid()')
+                first_id = cursor.fetchone()[0] - len(changed) + 1
+                self.add_ledger_entries(cursor, [(player_id, amount, 'admin_gift', first_id + index)
+                                                 for index, player_id in enumerate(changed)])
+
         conn.commit()
         conn.close()
+        return results
 
     def get_player_wallet(self, player_id):
         conn = self.get_connection()
@@ -936,4 +1657,522 @@ class Database:
             VALUES (?, 'ton_gift', ?, ?, ?, ?)
         ''', (player_id, amount, wallet_address, transaction_hash, note))
         conn.commit()
-        conn.close()
\ No newline at end of file
+        conn.close()
+
+    def get_owner_ton_wallets(self):
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT bot_config FROM bots WHERE bot_type = 'mining' AND bot_config IS NOT NULL")
+        rows = cursor.fetchall()
+        conn.close()
+
+        wallets = set()
+        for row in rows:
+            try:
+                wallet = (json.loads(row['bot_config']).get('owner_ton_wallet') or '').strip()
+            except (ValueError, AttributeError):
+                continue
+            if wallet:
+                wallets.add(wallet)
+        return sorted(wallets)
+
+    def get_ton_cursor(self, wallet_address):
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT * FROM ton_wallet_cursors WHERE wallet_address = ?', (wallet_address,))
+        row = cursor.fetchone()
+        conn.close()
+        return dict(row) if row else None
+
+    def record_ton_transactions(self, wallet_address, transactions, last_lt, last_hash, scan=None):
+        """Store parsed transactions, update the wallet cursor and match payments in one transaction.
+
+        ``scan`` is ``(scan_lt, scan_hash, scan_top_lt, scan_top_hash)`` while a
+        catch-up is unfinished: where paging resumes next time, and the newest
+        transaction of the backlog that ``last_lt`` moves to once it is done.
+        ``None`` clears it.
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+
+        inserted_ids = []
+        for tx in transactions:
+            cursor.execute('''
+                INSERT OR IGNORE INTO ton_transactions
+                (wallet_address, lt, tx_hash, direction, msg_index, counterparty, amount_nano, comment, utime)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (wallet_address, tx['lt'], tx['tx_hash'], tx['direction'], tx['msg_index'],
+                  tx['counterparty'], tx['amount_nano'], tx['comment'], tx['utime']))
+            if cursor.rowcount:
+                inserted_ids.append(cursor.lastrowid)
+
+        cursor.execute('''
+            INSERT INTO ton_wallet_cursors
+            (wallet_address, last_lt, last_hash, scan_lt, scan_hash, scan_top_lt, scan_top_hash, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT(wallet_address) DO UPDATE SET
+                last_lt = MAX(last_lt, excluded.last_lt),
+                last_hash = CASE WHEN excluded.last_lt >= last_lt THEN excluded.last_hash ELSE last_hash END,
+                scan_lt = excluded.scan_lt,
+                scan_hash = excluded.scan_hash,
+                scan_top_lt = excluded.scan_top_lt,
+                scan_top_hash = excluded.scan_top_hash,
+                updated_at = CURRENT_TIMESTAMP
+        ''', (wallet_address, last_lt, last_hash) + tuple(scan or (None, None, None, None)))
+
+        matched = self._match_ton_transactions(cursor, inserted_ids)
+        conn.commit()
+        conn.close()
+        return {'stored': len(inserted_ids), 'matched': matched}
+
+    def _match_ton_transactions(self, cursor, transaction_ids):
+        """Credit pending payments whose nonce appears as a transaction comment"""
+        matched = 0
+        for transaction_id in transaction_ids:
+            cursor.execute('SELECT * FROM ton_transactions WHERE id = ?', (transaction_id,))
+            tx = cursor.fetchone()
+            if not tx or not tx['comment']:
+                continue
+
+            if tx['direction'] == 'out':
+                matched += self._confirm_payout(cursor, tx)
+                continue
+
+            cursor.execute('SELECT * FROM payment_intents WHERE nonce = ?', (tx['comment'].strip(),))
+            intent = cursor.fetchone()
+            if intent:
+                matched += self._settle_payment_intent(cursor, intent, tx)
+                continue
+
+            cursor.execute('''
+                SELECT * FROM mining_deposits WHERE nonce = ? AND status = 'pending'
+            ''', (tx['comment'].strip(),))
+            deposit = cursor.fetchone()
+            if deposit and deposit['pay_to'] == tx['wallet_address']:
+                expected_nano = int(round((deposit['ton_amount'] or 0) * 1_000_000_000))
+                if tx['amount_nano'] < expected_nano:
+                    cursor.execute("UPDATE ton_transactions SET matched_type = 'underpaid', matched_id = ? WHERE id = ?",
+                                   (deposit['id'], transaction_id))
+                    continue
+
+                cursor.execute('UPDATE mining_players SET coins = coins + ? WHERE id = ?',
+                               (deposit['amount'], deposit['player_id']))
+                self.add_ledger_entries(cursor, [(deposit['player_id'], deposit['amount'], 'deposit', deposit['id'])])
+                cursor.execute('''
+                    UPDATE mining_deposits
+                    SET status = 'completed', transaction_hash = ?, processed_at = CURRENT_TIMESTAMP
+                    WHERE id = ?
+                ''', (tx['tx_hash'], deposit['id']))
+                cursor.execute("UPDATE ton_transactions SET matched_type = 'deposit', matched_id = ? WHERE id = ?",
+                               (deposit['id'], transaction_id))
+                matched += 1
+        return matched
+
+    def claim_ton_transaction(self, wallet_address, counterparty, min_amount_nano, max_amount_nano, tx_hash=None,
+                              matched_type='verified_payment'):
+        """Find an incoming transfer nothing has matched yet and mark it matched, so it verifies one payment only"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+        if tx_hash:
+            cursor.execute('''
+                SELECT * FROM ton_transactions
+                WHERE tx_hash = ? AND wallet_address = ? AND direction = 'in' AND matched_type IS NULL
+                ORDER BY msg_index LIMIT 1
+            ''', (tx_hash, wallet_address))
+        else:
+            cursor.execute('''
+                SELECT * FROM ton_transactions
+                WHERE wallet_address = ? AND direction = 'in' AND counterparty = ?
+                  AND amount_nano BETWEEN ? AND ? AND matched_type IS NULL
+                ORDER BY lt DESC LIMIT 1
+            ''', (wallet_address, counterparty, min_amount_nano, max_amount_nano))
+        tx = cursor.fetchone()
+        if tx:
+            cursor.execute('UPDATE ton_transactions SET matched_type = ? WHERE id = ?', (matched_type, tx['id']))
+        conn.commit()
+        conn.close()
+        return dict(tx) if tx else None
+
+    def create_pending_deposit(self, player_id, amount, ton_amount, pay_to):
+        conn = self.get_connection()
+        cursor = conn.cursor()
+
+        while True:
+            nonce = f'dep-{secrets.token_hex(5)}'
+            try:
+                cursor.execute('''
+                    INSERT INTO mining_deposits (player_id, amount, status, nonce, ton_amount, pay_to)
+                    VALUES (?, ?, 'pending', ?, ?, ?)
+                ''', (player_id, amount, nonce, ton_amount, pay_to))
+                break
+            except sqlite3.IntegrityError:
+                continue
+
+        deposit_id = cursor.lastrowid
+        conn.commit()
+        conn.close()
+        return deposit_id, nonce
+
+    def get_player_deposit(self, deposit_id, player_id):
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT * FROM mining_deposits WHERE id = ? AND player_id = ?', (deposit_id, player_id))
+        deposit = cursor.fetchone()
+        conn.close()
+        return dict(deposit) if deposit else None
+
+    def create_payment_intent(self, bot_id, player_id, intent_type, pay_to, amount_nano, reward_type,
+                              reward_amount, shop_item_id=None, ttl_minutes=30):
+        conn = self.get_connection()
+        cursor = conn.cursor()
+
+        while True:
+            nonce = f'pay-{secrets.token_hex(5)}'
+            try:
+                cursor.execute('''
+                    INSERT INTO payment_intents
+                    (nonce, bot_id, player_id, intent_type, shop_item_id, pay_to, amount_nano,
+                     reward_type, reward_amount, expires_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, DATETIME('now', ?))
+                ''', (nonce, bot_id, player_id, intent_type, shop_item_id, pay_to, amount_nano,
+                      reward_type, reward_amount, f'+{int(ttl_minutes)} minutes'))
+                break
+            except sqlite3.IntegrityError:
+                continue
+
+        intent_id = cursor.lastrowid
+        conn.commit()
+        cursor.execute('SELECT * FROM payment_intents WHERE id = ?', (intent_id,))
+        intent = cursor.fetchone()
+        conn.close()
+        return dict(intent)
+
+    def get_player_payment_intent(self, intent_id, player_id):
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT * FROM payment_intents WHERE id = ? AND player_id = ?', (intent_id, player_id))
+        intent = cursor.fetchone()
+        conn.close()
+        return dict(intent) if intent else None
+
+    def _transition_payment_intent(self, cursor, intent_id, from_status, to_status, transaction_hash=None):
+        """Move an intent along the state machine; False if it was not in from_status"""
+        if to_status not in PAYMENT_INTENT_TRANSITIONS.get(from_status, set()):
+            raise ValueError(f'Invalid payment intent transition {from_status} -> {to_status}')
+
+        cursor.execute('''
+            UPDATE payment_intents
+            SET status = ?,
+                transaction_hash = COALESCE(?, transaction_hash),
+                paid_at = CASE WHEN ? IS NOT NULL THEN CURRENT_TIMESTAMP ELSE paid_at END
+            WHERE id = ? AND status = ?
+        ''', (to_status, transaction_hash, transaction_hash, intent_id, from_status))
+        return cursor.rowcount > 0
+
+    def _settle_payment_intent(self, cursor, intent, tx):
+        if intent['pay_to'] != tx['wallet_address']:
+            return 0
+
+        status = intent['status']
+        if status not in ('pending', 'expired'):
+            return 0
+
+        # Compare when the transfer happened, not when the watcher got to it
+        expires_at = datetime.strptime(intent['expires_at'], '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc)
+        paid_at = datetime.fromtimestamp(tx['utime'], timezone.utc) if tx['utime'] else datetime.now(timezone.utc)
+        if paid_at > expires_at:
+            # Paid after expiry: keep the money traceable but leave crediting to the owner
+            if self._transition_payment_intent(cursor, intent['id'], status, 'late_payment', tx['tx_hash']):
+                cursor.execute("UPDATE ton_transactions SET matched_type = 'late_payment', matched_id = ? WHERE id = ?",
+                               (intent['id'], tx['id']))
+            return 0
+
+        if tx['amount_nano'] < intent['amount_nano']:
+            if self._transition_payment_intent(cursor, intent['id'], status, 'underpaid', tx['tx_hash']):
+                cursor.execute("UPDATE ton_transactions SET matched_type = 'underpaid', matched_id = ? WHERE id = ?",
+                               (intent['id'], tx['id']))
+            return 0
+
+        if not self._transition_payment_intent(cursor, intent['id'], status, 'completed', tx['tx_hash']):
+            return 0
+
+        if intent['reward_type'] == 'energy':
+            cursor.execute('UPDATE mining_players SET energy = energy + ? WHERE id = ?',
+                           (intent['reward_amount'], intent['player_id']))
+        else:
+            cursor.execute('UPDATE mining_players SET coins = coins + ? WHERE id = ?',
+                           (intent['reward_amount'], intent['player_id']))
+            self.add_ledger_entries(cursor, [(intent['player_id'], intent['reward_amount'], 'purchase', intent['id'])])
+
+        if intent['shop_item_id']:
+            cursor.execute('''
+                INSERT INTO mining_purchases (player_id, shop_item_id, amount_paid, payment_method, transaction_id)
+                VALUES (?, ?, ?, 'TON', ?)
+            ''', (intent['player_id'], intent['shop_item_id'], tx['amount_nano'] / 1_000_000_000, tx['tx_hash']))
+
+        cursor.execute("UPDATE ton_transactions SET matched_type = 'payment_intent', matched_id = ? WHERE id = ?",
+                       (intent['id'], tx['id']))
+        return 1
+
+    def expire_payment_intents(self):
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            UPDATE payment_intents SET status = 'expired'
+            WHERE status = 'pending' AND expires_at <= CURRENT_TIMESTAMP
+        ''')
+        expired = cursor.rowcount
+        conn.commit()
+        conn.close()
+        return expired
+
+    def create_payout_batches(self, bot_id, pay_from, exchange_rate, batch_size=1000):
+        """Group a bot's pending withdrawals into payout batches; returns the new batch ids"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        # Take the write lock before reading, so a concurrent call can't batch the same withdrawals
+        cursor.execute('BEGIN IMMEDIATE')
+        cursor.execute('''
+            SELECT mw.id, mw.net_amount, mw.ton_amount
+            FROM mining_withdrawals mw
+            JOIN mining_players mp ON mw.player_id = mp.id
+            WHERE mp.bot_id = ? AND mw.status = 'pending'
+            ORDER BY mw.id
+        ''', (bot_id,))
+        pending = cursor.fetchall()
+
+        batch_ids = []
+        for start in range(0, len(pending), batch_size):
+            chunk = pending[start:start + batch_size]
+            items = []
+            for row in chunk:
+                ton_amount = row['ton_amount'] if row['ton_amount'] is not None else row['net_amount'] / exchange_rate
+                items.append([int(round(ton_amount * 1_000_000_000)), None, row['id']])
+
+            cursor.execute('''
+                INSERT INTO payout_batches (bot_id, pay_from, item_count, total_nano)
+                VALUES (?, ?, ?, ?)
+            ''', (bot_id, pay_from, len(items), sum(item[0] for item in items)))
+            batch_id = cursor.lastrowid
+            for item in items:
+                item[1] = batch_id
+
+            cursor.executemany('''
+                UPDATE mining_withdrawals
+                SET status = 'batched', payout_nano = ?, batch_id = ?, payout_comment = 'wd-' || id
+                WHERE id = ? AND status = 'pending'
+            ''', items)
+            batch_ids.append(batch_id)
+
+        conn.commit()
+        conn.close()
+        return batch_ids
+
+    def get_payout_batches(self, user_id, limit=20):
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT pb.*, b.bot_name,
+                   (SELECT COUNT(*) FROM mining_withdrawals mw
+                    WHERE mw.batch_id = pb.id AND mw.status = 'confirmed') as confirmed_count
+            FROM payout_batches pb
+            JOIN bots b ON pb.bot_id = b.id
+            WHERE b.user_id = ?
+            ORDER BY pb.id DESC LIMIT ?
+        ''', (user_id, limit))
+        batches = cursor.fetchall()
+        conn.close()
+        return [dict(batch) for batch in batches]
+
+    def get_payout_batch(self, batch_id):
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT pb.*, b.user_id, b.bot_name FROM payout_batches pb
+            JOIN bots b ON pb.bot_id = b.id
+            WHERE pb.id = ?
+        ''', (batch_id,))
+        batch = cursor.fetchone()
+        conn.close()
+        return dict(batch) if batch else None
+
+    def iter_payout_items(self, batch_id):
+        """Yield the rows of a payout batch without loading the whole batch into memory"""
+        conn = self.get_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT id, wallet_address, payout_nano, payout_comment, status, transaction_hash
+                FROM mining_withdrawals WHERE batch_id = ? ORDER BY id
+            ''', (batch_id,))
+            for row in cursor:
+                yield dict(row)
+        finally:
+            conn.close()
+
+    def iter_bot_export_rows(self, dataset, bot_id):
+        """Yield one of the BOT_EXPORT_QUERIES datasets for a bot without loading it all"""
+        conn = self.get_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(BOT_EXPORT_QUERIES[dataset], (bot_id,))
+            for row in cursor:
+                yield dict(row)
+        finally:
+            conn.close()
+
+    def mark_payout_batch_sent(self, batch_id):
+        """Mark a batch as sent and confirm whatever the transaction index already holds"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            UPDATE mining_withdrawals SET status = 'sent', processed_at = CURRENT_TIMESTAMP
+            WHERE batch_id = ? AND status = 'batched'
+        ''', (batch_id,))
+        cursor.execute('''
+            UPDATE payout_batches SET status = 'sent', sent_at = CURRENT_TIMESTAMP
+            WHERE id = ? AND status = 'batched'
+        ''', (batch_id,))
+
+        cursor.execute('''
+            SELECT t.* FROM ton_transactions t
+            JOIN mining_withdrawals mw ON t.comment = mw.payout_comment
+            JOIN payout_batches pb ON mw.batch_id = pb.id
+            WHERE mw.batch_id = ? AND mw.status = 'sent'
+              AND t.direction = 'out' AND t.wallet_address = pb.pay_from
+        ''', (batch_id,))
+        confirmed = 0
+        for tx in cursor.fetchall():
+            confirmed += self._confirm_payout(cursor, tx)
+
+        conn.commit()
+        conn.close()
+        return confirmed
+
+    def _confirm_payout(self, cursor, tx):
+        cursor.execute('''
+            SELECT mw.id, mw.batch_id, mw.payout_nano, pb.pay_from
+            FROM mining_withdrawals mw
+            JOIN payout_batches pb ON mw.batch_id = pb.id
+            WHERE mw.payout_comment = ? AND mw.status IN ('batched', 'sent')
+        ''', (tx['comment'].strip(),))
+        withdrawal = cursor.fetchone()
+        if not withdrawal or withdrawal['pay_from'] != tx['wallet_address'] or tx['amount_nano'] < withdrawal['payout_nano']:
+            return 0
+
+        cursor.execute('''
+            UPDATE mining_withdrawals
+            SET status = 'confirmed', transaction_hash = ?, processed_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+        ''', (tx['tx_hash'], withdrawal['id']))
+        cursor.execute("UPDATE ton_transactions SET matched_type = 'withdrawal', matched_id = ? WHERE id = ?",
+                       (withdrawal['id'], tx['id']))
+
+        cursor.execute('''
+            UPDATE payout_batches SET status = 'confirmed', confirmed_at = CURRENT_TIMESTAMP
+            WHERE id = ? AND status != 'confirmed' AND NOT EXISTS (
+                SELECT 1 FROM mining_withdrawals WHERE batch_id = ? AND status != 'confirmed'
+            )
+        ''', (withdrawal['batch_id'], withdrawal['batch_id']))
+        return 1
+
+    def add_ledger_entries(self, cursor, entries):
+        """Append (player_id, delta, reason, ref_id) rows inside the caller's transaction"""
+        entries = [entry for entry in entries if entry[1]]
+        if entries:
+            cursor.executemany('''
+                INSERT INTO coin_ledger (player_id, delta, reason, ref_id) VALUES (?, ?, ?, ?)
+            ''', entries)
+
+    def snapshot_coin_balances(self):
+        """Write a snapshot for every player with ledger entries since the last run"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+        snapshotted = self._snapshot_coin_balances(cursor)
+        conn.commit()
+        conn.close()
+        return snapshotted
+
+    def _snapshot_coin_balances(self, cursor):
+        # Every run covers all ledger rows up to its watermark, so only newer rows need reading
+        cursor.execute('SELECT COALESCE(MAX(ledger_id), 0) FROM coin_balance_snapshots')
+        watermark = cursor.fetchone()[0]
+        cursor.execute('SELECT COALESCE(MAX(id), 0) FROM coin_ledger')
+        latest = cursor.fetchone()[0]
+        if latest <= watermark:
+            return 0
+
+        cursor.execute('''
+            INSERT INTO coin_balance_snapshots (player_id, ledger_id, balance)
+            SELECT l.player_id, MAX(l.id),
+                   COALESCE((SELECT s.balance FROM coin_balance_snapshots s
+                             WHERE s.player_id = l.player_id
+                             ORDER BY s.ledger_id DESC LIMIT 1), 0) + SUM(l.delta)
+            FROM coin_ledger l
+            WHERE l.id > ? AND l.id <= ?
+            GROUP BY l.player_id
+        ''', (watermark, latest))
+        return cursor.rowcount
+
+    def get_ledger_balance(self, player_id):
+        """Balance according to the ledger: latest snapshot plus the entries after it"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        balance = self._ledger_balance(cursor, player_id)
+        conn.close()
+        return balance
+
+    def _ledger_balance(self, cursor, player_id):
+        cursor.execute('''
+            SELECT ledger_id, balance FROM coin_balance_snapshots
+            WHERE player_id = ? ORDER BY ledger_id DESC LIMIT 1
+        ''', (player_id,))
+        snapshot = cursor.fetchone()
+        ledger_id, balance = (snapshot['ledger_id'], snapshot['balance']) if snapshot else (0, 0)
+        cursor.execute('''
+            SELECT COALESCE(SUM(delta), 0) FROM coin_ledger WHERE player_id = ? AND id > ?
+        ''', (player_id, ledger_id))
+        return balance + cursor.fetchone()[0]
+
+    def get_coin_history(self, player_id, limit=50):
+        """Most recent ledger entries, newest first, each with the balance after it"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        balance = self._ledger_balance(cursor, player_id)
+        cursor.execute('''
+            SELECT id, delta, reason, ref_id, created_at FROM coin_ledger
+            WHERE player_id = ? ORDER BY id DESC LIMIT ?
+        ''', (player_id, limit))
+        history = []
+        for row in cursor.fetchall():
+            entry = dict(row)
+            entry['balance'] = balance
+            balance -= entry['delta']
+            history.append(entry)
+        conn.close()
+        return history
+
+    def reconcile_coin_balances(self, tolerance=1e-6):
+        """Snapshot, then compare every player's coins with the ledger; returns the mismatches.
+
+        Both steps run in one write transaction, so the fresh snapshots are
+        exactly the ledger balances and nothing is re-summed from the start.
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+        self._snapshot_coin_balances(cursor)
+        cursor.execute('''
+            SELECT mp.id as player_id, mp.bot_id, mp.coins,
+                   COALESCE((SELECT s.balance FROM coin_balance_snapshots s
+                             WHERE s.player_id = mp.id
+                             ORDER BY s.ledger_id DESC LIMIT 1), 0) as ledger_balance
+            FROM mining_players mp
+        ''')
+        mismatches = [dict(row) for row in cursor.fetchall()
+                      if abs(row['coins'] - row['ledger_balance']) > tolerance]
+        conn.commit()
+        conn.close()
+        return mismatches
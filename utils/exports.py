@@ -0,0 +1,54 @@
+import json
+import zipfile
+
+
+class _ZipSink:
+    """Write-only file object that hands bytes back to the caller instead of keeping them.
+
+    It has no ``tell``/``seek``, so ``zipfile`` writes each entry with a data
+    descriptor and never needs to go back and patch a header.
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self.size = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        self.size = 0
+        return data
+
+
+def stream_zip(entries, chunk_size=64 * 1024):
+    """Yield a ZIP archive piece by piece.
+
+    ``entries`` is an iterable of ``(name, chunks)`` where ``chunks`` yields
+    bytes; nothing but the current compressor state and up to ``chunk_size``
+    output bytes is held at a time.
+    """
+    sink = _ZipSink()
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for name, chunks in entries:
+            with zf.open(name, 'w', force_zip64=True) as entry:
+                for chunk in chunks:
+                    entry.write(chunk)
+                    if sink.size >= chunk_size:
+                        yield sink.drain()
+            if sink.size:
+                yield sink.drain()
+    yield sink.drain()
+
+
+def iter_jsonl(rows):
+    """One JSON document per line, encoded for a ZIP entry"""
+    for row in rows:
+        yield (json.dumps(row, default=str) + '\n').encode('utf-8')
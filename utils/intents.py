@@ -0,0 +1,108 @@
+import re
+import json
+import threading
+from collections import OrderedDict
+
+DEFAULT_INTENTS = {
+    'price': {'keywords': ['price', 'cost', 'how much', 'value', 'worth'], 'priority': 50},
+    'buy': {'keywords': ['buy', 'purchase', 'get', 'acquire'], 'priority': 40},
+    'claim': {'keywords': ['claim', 'reward', 'airdrop', 'free'], 'priority': 30},
+    'help': {'keywords': ['help', 'support', 'how to', 'guide'], 'priority': 20},
+    'balance': {'keywords': ['balance', 'wallet', 'funds', 'money'], 'priority': 10}
+}
+
+MAX_CACHED_MATCHERS = 256
+
+
+def _normalize_keyword(keyword):
+    return ' '.join(str(keyword).lower().split())
+
+
+class IntentMatcher:
+    """Keyword intent detection compiled into a single alternation regex.
+
+    The intent table maps an intent name either to a list of keywords or to
+    a dict with ``keywords``, an optional ``priority`` (higher wins) and an
+    optional ``command`` the intent should be routed to. Keywords only match
+    on word boundaries; when several intents match, the highest priority wins
+    and ties go to the intent listed first.
+    """
+
+    def __init__(self, intents=None, default_intent='general'):
+        self.default_intent = default_intent
+        self.commands = {}
+        self._ranks = {}
+
+        table = DEFAULT_INTENTS if intents is None else intents
+        for order, (intent, spec) in enumerate(table.items()):
+            if isinstance(spec, dict):
+                keywords = spec.get('keywords', [])
+                priority = int(spec.get('priority', 0))
+                if spec.get('command'):
+                    self.commands[intent] = str(spec['command']).lstrip('/').lower()
+            else:
+                keywords = spec
+                priority = 0
+
+            for keyword in keywords:
+                keyword = _normalize_keyword(keyword)
+                if not keyword:
+                    continue
+                rank = (-priority, order, intent)
+                if keyword not in self._ranks or rank < self._ranks[keyword]:
+                    self._ranks[keyword] = rank
+
+        self._best_rank = min(self._ranks.values()) if self._ranks else None
+
+        if self._ranks:
+            # Longest keywords first so "how much" wins over a shorter overlap
+            alternatives = sorted(self._ranks, key=len, reverse=True)
+            pattern = '|'.join(re.escape(k).replace(r'\ ', r'\s+') for k in alternatives)
+            self._regex = re.compile(rf'(?<!\w)(?:{pattern})(?!\w)')
+        else:
+            self._regex = None
+
+    def match(self, message):
+        if not message or self._regex is None:
+            return self.default_intent
+
+        best = None
+        for found in self._regex.finditer(message.lower()):
+            rank = self._ranks[_normalize_keyword(found.group(0))]
+            if best is None or rank < best:
+                best = rank
+                if best == self._best_rank:
+                    break
+
+        return best[2] if best else self.default_intent
+
+    def match_many(self, messages):
+        return [self.match(message) for message in messages]
+
+    def command_for(self, intent):
+        return self.commands.get(intent)
+
+
+_matchers = OrderedDict()
+_matchers_lock = threading.Lock()
+
+
+def get_matcher(intents=None):
+    """Return a compiled matcher for an intent table, reusing cached ones"""
+    # Not sort_keys: table order breaks priority ties, so reordered tables need their own matcher
+    key = None if intents is None else json.dumps(intents)
+
+    with _matchers_lock:
+        matcher = _matchers.get(key)
+        if matcher is not None:
+            _matchers.move_to_end(key)
+            return matcher
+
+    matcher = IntentMatcher(intents)
+
+    with _matchers_lock:
+        _matchers[key] = matcher
+        while len(_matchers) > MAX_CACHED_MATCHERS:
+            _matchers.popitem(last=False)
+
+    return matcher
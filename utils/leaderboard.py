@@ -0,0 +1,198 @@
+import bisect
+import hashlib
+import json
+import os
+import threading
+import time
+
+PLAYER_FIELDS = ('username', 'first_name', 'coins', 'level', 'total_taps')
+
+# Leaderboard lengths that get a materialized snapshot; requested limits round up to one
+SNAPSHOT_SIZES = (10, 50, 100)
+
+
+class BotLeaderboard:
+    """Players of one bot kept sorted by coins, highest first.
+
+    ``_keys`` is a sorted list of ``(-coins, player_id)`` so the top N is a
+    slice and a player's position is a bisect. Ties keep the older player
+    (lower id) first.
+    """
+
+    def __init__(self, bot_id, rows=(), active=True):
+        self.bot_id = bot_id
+        self.active = active
+        self.loaded_at = time.monotonic()
+        self._players = {}
+        self._keys = []
+        self._lock = threading.Lock()
+
+        for row in rows:
+            self._players[row['id']] = {field: row[field] for field in PLAYER_FIELDS}
+        self._keys = sorted((-player['coins'], player_id) for player_id, player in self._players.items())
+
+    def __len__(self):
+        return len(self._keys)
+
+    def update(self, player_id, **fields):
+        """Apply changed fields for one player, re-positioning them if coins changed"""
+        with self._lock:
+            player = self._players.get(player_id)
+            if player is None:
+                player = {field: None for field in PLAYER_FIELDS}
+                player['coins'] = fields.get('coins', 0) or 0
+                self._players[player_id] = player
+                bisect.insort(self._keys, (-player['coins'], player_id))
+            elif 'coins' in fields and fields['coins'] != player['coins']:
+                old_key = (-player['coins'], player_id)
+                index = bisect.bisect_left(self._keys, old_key)
+                if index < len(self._keys) and self._keys[index] == old_key:
+                    del self._keys[index]
+                bisect.insort(self._keys, (-fields['coins'], player_id))
+
+            for field in PLAYER_FIELDS:
+                if field in fields:
+                    player[field] = fields[field]
+
+    def top(self, limit):
+        with self._lock:
+            return [dict(self._players[player_id]) for _, player_id in self._keys[:limit]]
+
+    def __contains__(self, player_id):
+        return player_id in self._players
+
+    def _rank_of(self, coins):
+        # (-coins,) sorts before every (-coins, id) key, so this counts players with more coins
+        return bisect.bisect_left(self._keys, (-coins,)) + 1
+
+    def _entry(self, player_id):
+        entry = dict(self._players[player_id])
+        entry['rank'] = self._rank_of(entry['coins'])
+        return entry
+
+    def rank(self, player_id, around=5):
+        """Exact rank (ties share a rank), percentile and up to ``around`` players either side"""
+        with self._lock:
+            player = self._players.get(player_id)
+            if player is None:
+                return None
+
+            total = len(self._keys)
+            position = bisect.bisect_left(self._keys, (-player['coins'], player_id))
+            rank = self._rank_of(player['coins'])
+            fewer = total - bisect.bisect_right(self._keys, (-player['coins'], float('inf')))
+
+            return {
+                'rank': rank,
+                'total': total,
+                'percentile': round(100.0 * fewer / total, 2),
+                'top_percent': round(100.0 * rank / total, 2),
+                'player': self._entry(player_id),
+                'above': [self._entry(pid) for _, pid in self._keys[max(0, position - around):position]],
+                'below': [self._entry(pid) for _, pid in self._keys[position + 1:position + 1 + around]]
+            }
+
+
+class LeaderboardStore:
+    """Per-bot in-process leaderboards, seeded from SQLite on first use.
+
+    Coin changes made by this process are applied with ``update_player``.
+    Changes made elsewhere (other gunicorn workers, the TON watcher) are
+    picked up by re-seeding a board in the background once it is older
+    than ``reconcile_interval`` seconds; readers keep using the old board
+    until the new one is swapped in.
+    """
+
+    def __init__(self, db, reconcile_interval=None, snapshot_ttl=None):
+        self.db = db
+        self.reconcile_interval = reconcile_interval or float(os.environ.get('LEADERBOARD_RECONCILE_INTERVAL', 60))
+        self.snapshot_ttl = snapshot_ttl if snapshot_ttl is not None else float(os.environ.get('LEADERBOARD_SNAPSHOT_TTL', 5))
+        self._boards = {}
+        self._snapshots = {}
+        self._refreshing = {}
+        self._lock = threading.Lock()
+
+    def _load(self, bot_id):
+        bot = self.db.get_bot(bot_id)
+        if not bot or not bot['is_active']:
+            return BotLeaderboard(bot_id, active=False)  # skip reading players nobody can see
+        return BotLeaderboard(bot_id, self.db.get_leaderboard_seed(bot_id))
+
+    def get(self, bot_id):
+        """The board for ``bot_id``, or None when the bot is missing or inactive"""
+        board = self._boards.get(bot_id)
+        if board is None:
+            board = self._load(bot_id)
+            if not board.active:
+                return None  # not cached, so activating the bot takes effect immediately
+            with self._lock:
+                board = self._boards.setdefault(bot_id, board)
+        elif time.monotonic() - board.loaded_at > self.reconcile_interval:
+            self._refresh_in_background(bot_id)
+        return board if board.active else None
+
+    def _refresh_in_background(self, bot_id):
+        with self._lock:
+            if bot_id in self._refreshing:
+                return
+            # Updates arriving while the new board loads are replayed onto it
+            self._refreshing[bot_id] = []
+        threading.Thread(target=self._refresh, args=(bot_id,), name=f'leaderboard-{bot_id}', daemon=True).start()
+
+    def _refresh(self, bot_id):
+        try:
+            board = self._load(bot_id)
+            with self._lock:
+                for player_id, fields in self._refreshing.get(bot_id, []):
+                    board.update(player_id, **fields)
+                self._boards[bot_id] = board
+        except Exception as e:
+            print(f"Leaderboard refresh error for bot {bot_id}: {e}")
+            stale = self._boards.get(bot_id)
+            if stale is not None:
+                stale.loaded_at = time.monotonic()  # retry after another interval
+        finally:
+            with self._lock:
+                self._refreshing.pop(bot_id, None)
+
+    def update_player(self, player):
+        """Apply a freshly read mining_players row to its bot's board, if loaded"""
+        if not player:
+            return
+        fields = {field: player[field] for field in PLAYER_FIELDS if field in player}
+        with self._lock:
+            board = self._boards.get(player['bot_id'])
+            if player['bot_id'] in self._refreshing:
+                self._refreshing[player['bot_id']].append((player['id'], fields))
+        if board is not None:
+            board.update(player['id'], **fields)
+
+    def invalidate(self, bot_id):
+        with self._lock:
+            self._boards.pop(bot_id, None)
+            for size in SNAPSHOT_SIZES:
+                self._snapshots.pop((bot_id, size), None)
+
+    @staticmethod
+    def snapshot_size(limit):
+        """Clamp a requested limit to the nearest snapshot size at or above it"""
+        for size in SNAPSHOT_SIZES:
+            if limit <= size:
+                return size
+        return SNAPSHOT_SIZES[-1]
+
+    def snapshot(self, bot_id, limit):
+        """Serialized top-N JSON body and its ETag, rebuilt at most every ``snapshot_ttl`` seconds"""
+        size = self.snapshot_size(limit)
+        cached = self._snapshots.get((bot_id, size))
+        if cached and time.monotonic() - cached[0] < self.snapshot_ttl:
+            return cached[1], cached[2]
+
+        board = self.get(bot_id)
+        if board is None:
+            return None
+
+        body = json.dumps({'success': True, 'leaderboard': board.top(size)}, separators=(',', ':')).encode()
+        etag = hashlib.sha1(body).hexdigest()[:20]
+        self._snapshots[(bot_id, size)] = (time.monotonic(), body, etag)
+        return body, etag
@@ -0,0 +1,75 @@
+import os
+import threading
+import time
+
+
+class LedgerSnapshotter:
+    """Periodically snapshots coin balances from the ledger and reconciles them.
+
+    Snapshots only read ledger rows written since the previous run, so each
+    pass costs the number of new entries rather than the size of the ledger.
+    Every ``reconcile_every`` passes the players' ``coins`` are also checked
+    against the fresh snapshots and any mismatch is printed.
+    """
+
+    def __init__(self, db, interval=None, reconcile_every=12):
+        self.db = db
+        self.interval = interval or float(os.environ.get('LEDGER_SNAPSHOT_INTERVAL', 300))
+        self.reconcile_every = reconcile_every
+        self._runs = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def run_once(self, reconcile=False):
+        if reconcile:
+            mismatches = self.db.reconcile_coin_balances()
+            for row in mismatches:
+                print(f"Ledger mismatch for player {row['player_id']}: coins={row['coins']} ledger={row['ledger_balance']}")
+            return {'reconciled': True, 'mismatches': len(mismatches)}
+        return {'snapshots': self.db.snapshot_coin_balances()}
+
+    def tick(self):
+        self._runs += 1
+        try:
+            return self.run_once(reconcile=self._runs % self.reconcile_every == 0)
+        except Exception as e:
+            print(f"Ledger snapshot error: {e}")
+            return None
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            self.tick()
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name='ledger-snapshots', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+
+def main():
+    import argparse
+    from utils.database import Database
+
+    parser = argparse.ArgumentParser(description='Snapshot and reconcile mining coin balances')
+    parser.add_argument('--db', default=os.environ.get('DATABASE_PATH', 'database.db'))
+    parser.add_argument('--once', action='store_true', help='take one snapshot and exit')
+    parser.add_argument('--reconcile', action='store_true', help='check coins against the ledger and exit')
+    args = parser.parse_args()
+
+    snapshotter = LedgerSnapshotter(Database(args.db))
+    if args.reconcile or args.once:
+        print(snapshotter.run_once(reconcile=args.reconcile))
+        return
+
+    print(f"Snapshotting coin balances every {snapshotter.interval:.0f}s")
+    while True:
+        time.sleep(snapshotter.interval)
+        print(snapshotter.tick())
+
+
+if __name__ == '__main__':
+    main()
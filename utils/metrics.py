@@ -0,0 +1,154 @@
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def route_label(rule):
+    """``/webhook/<int:bot_id>`` -> ``/webhook/<bot_id>``; unmatched URLs share one label"""
+    if rule is None:
+        return '<unmatched>'
+    return re.sub(r'<(?:[^:<>]+:)?([^<>]+)>', r'<\1>', rule.rule)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels):
+    return ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items())
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class RequestMetrics:
+    """Per-route latency histograms, status counts and in-flight gauges.
+
+    Each process keeps its own numbers and writes them to
+    ``<directory>/metrics-<pid>.json`` at most every ``flush_interval``
+    seconds. ``render`` sums the files of every worker, so whichever gunicorn
+    worker answers ``/metrics`` reports the whole server. Counters of workers
+    that have exited are kept (they stay cumulative); their in-flight gauges
+    are dropped.
+    """
+
+    def __init__(self, directory=None, flush_interval=1.0):
+        self.directory = directory or os.environ.get('METRICS_DIR') or os.path.join(tempfile.gettempdir(), 'bot_metrics')
+        self.flush_interval = flush_interval
+        self._histograms = {}  # (method, route) -> [count, sum, bucket counts...]
+        self._statuses = {}  # (method, route, status) -> count
+        self._in_flight = {}  # (method, route) -> count
+        self._lock = threading.Lock()
+        self._flushed_at = 0.0
+        os.makedirs(self.directory, exist_ok=True)
+
+    def start(self, method, route):
+        with self._lock:
+            key = (method, route)
+            self._in_flight[key] = self._in_flight.get(key, 0) + 1
+
+    def finish(self, method, route, status, duration):
+        with self._lock:
+            key = (method, route)
+            self._in_flight[key] = self._in_flight.get(key, 1) - 1
+
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [0, 0.0] + [0] * len(LATENCY_BUCKETS)
+            histogram[0] += 1
+            histogram[1] += duration
+            for index, bound in enumerate(LATENCY_BUCKETS):
+                if duration <= bound:
+                    histogram[2 + index] += 1
+                    break
+
+            status_key = (method, route, status)
+            self._statuses[status_key] = self._statuses.get(status_key, 0) + 1
+
+        if time.monotonic() - self._flushed_at >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            self._flushed_at = time.monotonic()
+            state = {
+                'pid': os.getpid(),
+                'histograms': [list(key) + values for key, values in self._histograms.items()],
+                'statuses': [list(key) + [count] for key, count in self._statuses.items()],
+                'in_flight': [list(key) + [count] for key, count in self._in_flight.items()]
+            }
+
+        path = os.path.join(self.directory, f'metrics-{os.getpid()}.json')
+        try:
+            with open(path + '.tmp', 'w') as f:
+                json.dump(state, f)
+            os.replace(path + '.tmp', path)
+        except OSError as e:
+            print(f"Metrics flush error: {e}")
+
+    def collect(self):
+        """Sum the flushed state of every worker"""
+        self.flush()
+        histograms, statuses, in_flight = {}, {}, {}
+
+        for filename in os.listdir(self.directory):
+            if not (filename.startswith('metrics-') and filename.endswith('.json')):
+                continue
+            try:
+                with open(os.path.join(self.directory, filename)) as f:
+                    state = json.load(f)
+            except (OSError, ValueError):
+                continue  # mid-replace or removed; the next scrape will see it
+
+            for method, route, *values in state['histograms']:
+                total = histograms.setdefault((method, route), [0, 0.0] + [0] * len(LATENCY_BUCKETS))
+                for index, value in enumerate(values):
+                    total[index] += value
+            for method, route, status, count in state['statuses']:
+                statuses[(method, route, status)] = statuses.get((method, route, status), 0) + count
+            if _pid_alive(state['pid']):
+                for method, route, count in state['in_flight']:
+                    in_flight[(method, route)] = in_flight.get((method, route), 0) + count
+
+        return histograms, statuses, in_flight
+
+    def render(self):
+        """Prometheus text exposition format"""
+        histograms, statuses, in_flight = self.collect()
+        lines = [
+            '# HELP http_request_duration_seconds Request latency by route template.',
+            '# TYPE http_request_duration_seconds histogram'
+        ]
+        for (method, route), values in sorted(histograms.items()):
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS, values[2:]):
+                cumulative += count
+                lines.append(f'http_request_duration_seconds_bucket{{{_labels(method=method, route=route, le=bound)}}} {cumulative}')
+            lines.append(f'http_request_duration_seconds_bucket{{{_labels(method=method, route=route, le="+Inf")}}} {values[0]}')
+            lines.append(f'http_request_duration_seconds_sum{{{_labels(method=method, route=route)}}} {values[1]:.6f}')
+            lines.append(f'http_request_duration_seconds_count{{{_labels(method=method, route=route)}}} {values[0]}')
+
+        lines += ['# HELP http_requests_total Finished requests by route template and status code.',
+                  '# TYPE http_requests_total counter']
+        for (method, route, status), count in sorted(statuses.items()):
+            lines.append(f'http_requests_total{{{_labels(method=method, route=route, status=status)}}} {count}')
+
+        lines += ['# HELP http_requests_in_flight Requests currently being handled.',
+                  '# TYPE http_requests_in_flight gauge']
+        for (method, route), count in sorted(in_flight.items()):
+            lines.append(f'http_requests_in_flight{{{_labels(method=method, route=route)}}} {count}')
+
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,184 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+
+
+def normalize_sql(sql):
+    """Collapse whitespace, literals and IN lists so repeats of one statement group together"""
+    sql = re.sub(r"'(?:[^']|'')*'", '?', sql)
+    sql = re.sub(r'\b\d+(?:\.\d+)?\b', '?', sql)
+    sql = re.sub(r'\(\s*\?(?:\s*,\s*\?)+\s*\)', '(?, ...)', sql)
+    return ' '.join(sql.split())
+
+
+class _ProfiledCursor(sqlite3.Cursor):
+    """Times execute and the fetches that follow it, and counts the rows they return"""
+
+    def _begin(self, sql):
+        self._entry = self.connection.profiler.statement(sql)
+        return time.perf_counter()
+
+    def _end(self, started, rows=0):
+        entry = getattr(self, '_entry', None)
+        if entry is not None:
+            entry['duration'] += time.perf_counter() - started
+            entry['rows'] += rows
+
+    def execute(self, sql, parameters=()):
+        started = self._begin(sql)
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._end(started, max(self.rowcount, 0))
+
+    def executemany(self, sql, seq_of_parameters):
+        started = self._begin(sql)
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self._end(started, max(self.rowcount, 0))
+
+    def fetchone(self):
+        started = time.perf_counter()
+        row = super().fetchone()
+        self._end(started, 1 if row is not None else 0)
+        return row
+
+    def fetchmany(self, size=None):
+        started = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._end(started, len(rows))
+        return rows
+
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = super().fetchall()
+        self._end(started, len(rows))
+        return rows
+
+    def __next__(self):
+        started = time.perf_counter()
+        row = super().__next__()
+        self._end(started, 1)
+        return row
+
+
+class _ProfiledConnection(sqlite3.Connection):
+    # Only cursors are profiled; Connection.execute (used for the per-connection PRAGMA) is not
+    profiler = None
+
+    def cursor(self, factory=_ProfiledCursor):
+        return super().cursor(factory)
+
+
+class SQLProfiler:
+    """Opt-in statement timing for ``Database`` connections.
+
+    While a request is being traced (``begin_request`` .. ``end_request``)
+    every statement is appended to its trace with its duration and row count.
+    Requests over ``max_queries`` statements or ``max_ms`` of SQL time, or
+    that repeat one statement ``n_plus_one`` times or more, are flagged and
+    printed. All statements, traced or not, feed a per-statement aggregate
+    for ``top``.
+    """
+
+    def __init__(self, max_queries=None, max_ms=None, n_plus_one=None, max_statements=1000):
+        self.max_queries = max_queries or int(os.environ.get('SQL_PROFILE_MAX_QUERIES', 20))
+        self.max_ms = max_ms or float(os.environ.get('SQL_PROFILE_MAX_MS', 100))
+        self.n_plus_one = n_plus_one or int(os.environ.get('SQL_PROFILE_N_PLUS_ONE', 5))
+        self.max_statements = max_statements
+        self._local = threading.local()
+        self._totals = {}  # normalized sql -> {'count', 'total', 'max', 'rows'}
+        self._entries = deque()  # statements not yet folded into _totals
+        self.flagged = deque(maxlen=50)
+        self._lock = threading.Lock()
+
+    def connect(self, db_path):
+        conn = sqlite3.connect(db_path, factory=_ProfiledConnection)
+        conn.profiler = self
+        return conn
+
+    def statement(self, sql):
+        entry = {'sql': sql, 'duration': 0.0, 'rows': 0}
+        trace = getattr(self._local, 'trace', None)
+        if trace is not None:
+            trace.append(entry)
+        # Durations keep growing while rows are fetched, so aggregate lazily
+        self._entries.append(entry)
+        return entry
+
+    def _fold(self):
+        with self._lock:
+            while self._entries:
+                entry = self._entries.popleft()
+                key = normalize_sql(entry['sql'])
+                totals = self._totals.get(key)
+                if totals is None:
+                    if len(self._totals) >= self.max_statements:
+                        continue
+                    totals = self._totals[key] = {'count': 0, 'total': 0.0, 'max': 0.0, 'rows': 0}
+                totals['count'] += 1
+                totals['total'] += entry['duration']
+                totals['max'] = max(totals['max'], entry['duration'])
+                totals['rows'] += entry['rows']
+
+    def begin_request(self):
+        self._local.trace = []
+
+    def end_request(self, label):
+        """Stop tracing this thread's request; returns its summary"""
+        trace = getattr(self._local, 'trace', None)
+        self._local.trace = None
+        if trace is None:
+            return None
+
+        total_ms = sum(entry['duration'] for entry in trace) * 1000
+        repeats = {}
+        for entry in trace:
+            key = normalize_sql(entry['sql'])
+            repeats[key] = repeats.get(key, 0) + 1
+
+        flags = []
+        if len(trace) > self.max_queries:
+            flags.append(f'{len(trace)} queries (budget {self.max_queries})')
+        if total_ms > self.max_ms:
+            flags.append(f'{total_ms:.1f} ms in SQL (budget {self.max_ms:.0f} ms)')
+        for key, count in repeats.items():
+            if count >= self.n_plus_one:
+                flags.append(f'possible N+1: {count}x {key[:120]}')
+
+        self._fold()
+        summary = {
+            'request': label,
+            'queries': len(trace),
+            'total_ms': round(total_ms, 3),
+            'flags': flags,
+            'statements': [
+                {'sql': ' '.join(entry['sql'].split()), 'ms': round(entry['duration'] * 1000, 3), 'rows': entry['rows']}
+                for entry in trace
+            ]
+        }
+        if flags:
+            self.flagged.append({key: summary[key] for key in ('request', 'queries', 'total_ms', 'flags')})
+            print(f"SQL budget exceeded for {label}: {'; '.join(flags)}")
+        return summary
+
+    def top(self, limit=20):
+        """Statements with the most total time across all requests"""
+        self._fold()
+        with self._lock:
+            ranked = sorted(self._totals.items(), key=lambda item: item[1]['total'], reverse=True)[:limit]
+        return [
+            {
+                'sql': sql,
+                'count': totals['count'],
+                'total_ms': round(totals['total'] * 1000, 3),
+                'avg_ms': round(totals['total'] * 1000 / totals['count'], 3),
+                'max_ms': round(totals['max'] * 1000, 3),
+                'rows': totals['rows']
+            }
+            for sql, totals in ranked
+        ]
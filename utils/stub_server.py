@@ -0,0 +1,353 @@
+"""Local stand-in for the external APIs the app talks to.
+
+Serves just enough of the Telegram Bot API, CoinGecko, toncenter, TinyURL
+and Gemini to exercise our code paths offline, with injectable latency,
+server errors and 429 rate limiting. Point the app at it with:
+
+    TELEGRAM_API_BASE=http://127.0.0.1:8081/telegram
+    COINGECKO_API_BASE=http://127.0.0.1:8081/coingecko
+    TONCENTER_API_BASE=http://127.0.0.1:8081/toncenter
+    TINYURL_API_BASE=http://127.0.0.1:8081/tinyurl
+    GEMINI_API_BASE=http://127.0.0.1:8081
+
+Run it with ``python -m utils.stub_server --port 8081 --latency 50 --error-rate 0.01``.
+Fault settings can be changed at runtime by POSTing JSON to /_stub/config,
+toncenter transactions are injected through /_stub/toncenter/transactions
+and per-route request counts are available at /_stub/stats.
+"""
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class StubState:
+    def __init__(self, latency_ms=0, jitter_ms=0, error_rate=0.0, rate_limit_rate=0.0, retry_after=1, seed=None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = Counter()
+        self.message_id = 0
+        self.short_id = 0
+        self.transactions = {}
+        self.next_lt = 1000
+
+    def config(self):
+        return {
+            'latency_ms': self.latency_ms,
+            'jitter_ms': self.jitter_ms,
+            'error_rate': self.error_rate,
+            'rate_limit_rate': self.rate_limit_rate,
+            'retry_after': self.retry_after
+        }
+
+    def update(self, values):
+        for key in ('latency_ms', 'jitter_ms', 'error_rate', 'rate_limit_rate', 'retry_after'):
+            if key in values:
+                setattr(self, key, type(getattr(self, key))(values[key]))
+
+    def add_transaction(self, address, source, value, comment='', destination=None):
+        """Append a transaction to an address; nanoton ``value``, newest first"""
+        with self.lock:
+            self.next_lt += 1
+            lt = self.next_lt
+            tx_hash = hashlib.sha256(f'{address}:{lt}'.encode()).hexdigest()
+            tx = {
+                'utime': int(time.time()),
+                'transaction_id': {'lt': str(lt), 'hash': tx_hash},
+                'in_msg': {'source': source or '', 'destination': address, 'value': str(int(value)), 'message': comment},
+                'out_msgs': []
+            }
+            if destination:
+                tx['in_msg'] = {'source': '', 'destination': address, 'value': '0', 'message': ''}
+                tx['out_msgs'] = [{'source': address, 'destination': destination, 'value': str(int(value)), 'message': comment}]
+            self.transactions.setdefault(address, []).insert(0, tx)
+            return tx
+
+
+def _fake_price(coin_id):
+    digest = hashlib.md5(coin_id.encode()).digest()
+    return round(int.from_bytes(digest[:4], 'big') % 100000 / 10 + 0.01, 2)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    server_version = 'BotForgeStub/1.0'
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def state(self):
+        return self.server.state
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def _read_params(self, method):
+        parsed = urlparse(self.path)
+        params = {k: v[-1] for k, v in parse_qs(parsed.query).items()}
+
+        if method == 'POST':
+            length = int(self.headers.get('Content-Length') or 0)
+            body = self.rfile.read(length) if length else b''
+            content_type = self.headers.get('Content-Type', '')
+            if body and 'json' in content_type:
+                try:
+                    params.update(json.loads(body))
+                except ValueError:
+                    pass
+            elif body:
+                params.update({k: v[-1] for k, v in parse_qs(body.decode()).items()})
+
+        return parsed.path, params
+
+    def _send(self, status, payload, content_type='application/json', headers=None):
+        body = payload if isinstance(payload, bytes) else (
+            payload.encode() if isinstance(payload, str) else json.dumps(payload).encode()
+        )
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _inject_faults(self, service):
+        """Apply latency and return True when a fault response was sent"""
+        state = self.state
+        delay = state.latency_ms + (state.random.uniform(0, state.jitter_ms) if state.jitter_ms else 0)
+        if delay:
+            time.sleep(delay / 1000)
+
+        roll = state.random.random()
+        if roll < state.rate_limit_rate:
+            state.stats[f'{service}:429'] += 1
+            payload = {'ok': False, 'error_code': 429,
+                       'description': f'Too Many Requests: retry after {state.retry_after}',
+                       'parameters': {'retry_after': state.retry_after}}
+            self._send(429, payload, headers={'Retry-After': str(state.retry_after)})
+            return True
+        if roll < state.rate_limit_rate + state.error_rate:
+            state.stats[f'{service}:500'] += 1
+            self._send(500, {'ok': False, 'error_code': 500, 'description': 'Internal Server Error'})
+            return True
+        return False
+
+    def _handle(self, method):
+        path, params = self._read_params(method)
+        parts = [p for p in path.split('/') if p]
+
+        if parts[:1] == ['_stub']:
+            return self._handle_control(parts[1:], params)
+
+        service = parts[0] if parts else ''
+        if service.startswith('v1'):
+            service = 'gemini'
+        handler = {
+            'telegram': self._telegram,
+            'coingecko': self._coingecko,
+            'toncenter': self._toncenter,
+            'tinyurl': self._tinyurl,
+            'gemini': self._gemini
+        }.get(service)
+
+        if handler is None:
+            return self._send(404, {'error': f'Unknown path {path}'})
+
+        route = '/'.join(parts[2:] if service == 'telegram' else parts[1:]) or '/'
+        if service == 'gemini':
+            route = parts[-1].split(':')[-1]
+        self.state.stats[f'{service}:{route}'] += 1
+
+        if self._inject_faults(service):
+            return
+        handler(parts, params)
+
+    def _handle_control(self, parts, params):
+        route = '/'.join(parts)
+        if route == 'config':
+            self.state.update(params)
+            return self._send(200, self.state.config())
+        if route == 'stats':
+            return self._send(200, dict(self.state.stats))
+        if route == 'reset':
+            self.state.stats.clear()
+            return self._send(200, {'ok': True})
+        if route == 'toncenter/transactions':
+            tx = self.state.add_transaction(
+                params.get('address', ''), params.get('source', ''), params.get('value', 0),
+                params.get('comment', ''), params.get('destination')
+            )
+            return self._send(200, tx)
+        return self._send(404, {'error': f'Unknown control route {route}'})
+
+    def _telegram(self, parts, params):
+        if len(parts) < 3 or not parts[1].startswith('bot'):
+            return self._send(404, {'ok': False, 'error_code': 404, 'description': 'Not Found'})
+
+        token = parts[1][3:]
+        method = parts[2]
+        if ':' not in token or token.endswith(':invalid'):
+            return self._send(401, {'ok': False, 'error_code': 401, 'description': 'Unauthorized'})
+
+        bot_id = token.split(':')[0]
+        if method == 'getMe':
+            result = {'id': int(bot_id) if bot_id.isdigit() else 1, 'is_bot': True,
+                      'first_name': 'Stub Bot', 'username': f'stub_{bot_id}_bot'}
+        elif method == 'sendMessage':
+            with self.state.lock:
+                self.state.message_id += 1
+                message_id = self.state.message_id
+            result = {'message_id': message_id, 'date': int(time.time()),
+                      'chat': {'id': params.get('chat_id'), 'type': 'private'}, 'text': params.get('text', '')}
+        elif method == 'getUpdates':
+            result = []
+        elif method in ('setWebhook', 'deleteWebhook', 'setMyCommands', 'answerCallbackQuery', 'sendChatAction'):
+            result = True
+        else:
+            return self._send(404, {'ok': False, 'error_code': 404, 'description': 'Not Found: method not found'})
+
+        self._send(200, {'ok': True, 'result': result})
+
+    def _coingecko(self, parts, params):
+        route = '/'.join(parts[1:])
+        if route == 'simple/price':
+            currency = params.get('vs_currencies', 'usd').split(',')[0]
+            data = {}
+            for coin_id in filter(None, params.get('ids', '').split(',')):
+                price = _fake_price(coin_id)
+                data[coin_id] = {
+                    currency: price,
+                    f'{currency}_24h_change': round((price % 10) - 5, 2),
+                    f'{currency}_market_cap': price * 1_000_000
+                }
+            return self._send(200, data)
+        if route == 'search/trending':
+            coins = [{'item': {'id': f'coin{i}', 'name': f'Coin {i}', 'symbol': f'C{i}', 'market_cap_rank': i}}
+                     for i in range(1, 8)]
+            return self._send(200, {'coins': coins})
+        if route == 'search':
+            query = params.get('query', 'coin')
+            coins = [{'id': f'{query}-{i}', 'name': f'{query.title()} {i}', 'symbol': query[:4].upper(),
+                      'market_cap_rank': i} for i in range(1, 4)]
+            return self._send(200, {'coins': coins})
+        if route == 'global':
+            return self._send(200, {'data': {
+                'active_cryptocurrencies': 10000,
+                'total_market_cap': {'usd': 2.5e12},
+                'total_volume': {'usd': 9.0e10},
+                'market_cap_change_percentage_24h_usd': 1.5
+            }})
+        self._send(404, {'error': 'Not found'})
+
+    def _toncenter(self, parts, params):
+        route = '/'.join(parts[1:])
+        address = params.get('address', '')
+        transactions = self.state.transactions.get(address, [])
+
+        if route == 'getTransactions':
+            limit = int(params.get('limit', 10))
+            if params.get('lt'):
+                start = int(params['lt'])
+                transactions = [tx for tx in transactions if int(tx['transaction_id']['lt']) <= start]
+            if params.get('to_lt'):
+                stop = int(params['to_lt'])
+                transactions = [tx for tx in transactions if int(tx['transaction_id']['lt']) > stop]
+            return self._send(200, {'ok': True, 'result': transactions[:limit]})
+        if route == 'getAddressBalance':
+            balance = sum(int(tx['in_msg']['value']) for tx in transactions) or 1_000_000_000
+            return self._send(200, {'ok': True, 'result': str(balance)})
+        if route == 'getAddressInformation':
+            return self._send(200, {'ok': True, 'result': {'balance': '1000000000', 'state': 'active'}})
+        self._send(404, {'ok': False, 'error': 'Not found'})
+
+    def _tinyurl(self, parts, params):
+        if parts[1:] != ['api-create.php'] or not params.get('url'):
+            return self._send(400, 'Error', content_type='text/plain')
+        with self.state.lock:
+            self.state.short_id += 1
+            short_id = self.state.short_id
+        self._send(200, f'https://tinyurl.com/stub{short_id}', content_type='text/plain')
+
+    def _gemini(self, parts, params):
+        action = parts[-1].split(':')[-1] if parts else ''
+        if action != 'generateContent':
+            return self._send(404, {'error': {'code': 404, 'message': 'Not found'}})
+
+        prompt = ''
+        for content in params.get('contents', []):
+            for part in content.get('parts', []):
+                prompt += part.get('text', '')
+        text = f'Stub reply ({len(prompt)} chars of prompt).'
+        self._send(200, {'candidates': [{
+            'content': {'parts': [{'text': text}], 'role': 'model'},
+            'finishReason': 'STOP',
+            'index': 0
+        }]})
+
+
+def start_stub_server(host='127.0.0.1', port=0, **faults):
+    """Start the stub in a daemon thread; returns (server, base_url)"""
+    server = ThreadingHTTPServer((host, port), StubHandler)
+    server.daemon_threads = True
+    server.state = StubState(**faults)
+    thread = threading.Thread(target=server.serve_forever, name='api-stub', daemon=True)
+    thread.start()
+    return server, f'http://{host}:{server.server_address[1]}'
+
+
+def stub_environment(base_url):
+    """Environment variables that point the app at a running stub"""
+    return {
+        'TELEGRAM_API_BASE': f'{base_url}/telegram',
+        'COINGECKO_API_BASE': f'{base_url}/coingecko',
+        'TONCENTER_API_BASE': f'{base_url}/toncenter',
+        'TINYURL_API_BASE': f'{base_url}/tinyurl',
+        'GEMINI_API_BASE': base_url
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stand-in for Telegram, CoinGecko, toncenter, TinyURL and Gemini')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency', type=int, default=0, help='base latency per request in ms')
+    parser.add_argument('--jitter', type=int, default=0, help='extra random latency in ms')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests answered with 500')
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='fraction of requests answered with 429')
+    parser.add_argument('--retry-after', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    server, base_url = start_stub_server(
+        args.host, args.port,
+        latency_ms=args.latency, jitter_ms=args.jitter, error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate, retry_after=args.retry_after, seed=args.seed
+    )
+    print(f"API stub listening on {base_url}")
+    for name, value in stub_environment(base_url).items():
+        print(f"  export {name}={value}")
+
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,18 +1,20 @@
+import os
 import requests
 import json
 
 class TelegramAPI:
-    def __init__(self, bot_token=None):
+    def __init__(self, bot_token=None, api_base=None):
+        self.api_base = (api_base or os.environ.get('TELEGRAM_API_BASE', 'https://api.telegram.org')).rstrip('/')
         self.bot_token = bot_token
-        self.base_url = f'https://api.telegram.org/bot{bot_token}' if bot_token else None
+        self.base_url = f'{self.api_base}/bot{bot_token}' if bot_token else None
 
     def set_token(self, bot_token):
         self.bot_token = bot_token
-        self.base_url = f'https://api.telegram.org/bot{bot_token}'
+        self.base_url = f'{self.api_base}/bot{bot_token}'
 
     def verify_token(self, bot_token):
         try:
-            url = f'https://api.telegram.org/bot{bot_token}/getMe'
+            url = f'{self.api_base}/bot{bot_token}/getMe'
             response = requests.get(url, timeout=10)
             if response.status_code == 200:
                 data = response.json()
@@ -60,6 +62,18 @@ class TelegramAPI:
             print(f"Error sending message: {e}")
             return None
 
+    def send_chat_action(self, chat_id, action='typing'):
+        """Show a chat action such as 'typing' while a reply is prepared"""
+        url = f"{self.base_url}/sendChatAction"
+        data = {'chat_id': chat_id, 'action': action}
+
+        try:
+            response = requests.post(url, json=data, timeout=5)
+            return response.json()
+        except Exception as e:
+            print(f"Error sending chat action: {e}")
+            return None
+
     def set_webhook(self, webhook_url):
         """Set webhook for the bot"""
         url = f"{self.base_url}/setWebhook"
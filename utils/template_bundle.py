@@ -0,0 +1,107 @@
+import json
+import os
+import zipfile
+
+
+class BundleError(ValueError):
+    """The uploaded template bundle is malformed or over a limit"""
+
+
+class _ByteBudget:
+    """Decompressed bytes one ``read`` call may still unpack"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.remaining = limit
+
+    def spend(self, size):
+        self.remaining -= size
+        if self.remaining < 0:
+            raise BundleError(f'Zip contents are larger than {self.limit // (1024 * 1024)} MB.')
+
+
+class TemplateBundleReader:
+    """Reads template ZIPs straight from the upload's file object, within limits.
+
+    A bundle holds ``metadata.json`` plus one JSON file per template. The
+    metadata is either a single template (``title``, ``description``,
+    ``category``, ``template_file``, as written by the export route) or
+    ``{"templates": [...]}`` listing several of those. Sizes declared in the
+    ZIP directory are checked up front, and actual decompressed bytes are
+    counted while reading, since declared sizes can lie. The reader holds no
+    per-upload state, so one instance can serve concurrent requests.
+    """
+
+    def __init__(self, max_entries=None, max_bytes=None, max_ratio=None):
+        self.max_entries = max_entries or int(os.environ.get('TEMPLATE_IMPORT_MAX_ENTRIES', 200))
+        self.max_bytes = max_bytes or int(os.environ.get('TEMPLATE_IMPORT_MAX_BYTES', 20 * 1024 * 1024))
+        self.max_ratio = max_ratio or float(os.environ.get('TEMPLATE_IMPORT_MAX_RATIO', 100))
+
+    def _check_directory(self, zf):
+        infos = zf.infolist()
+        if len(infos) > self.max_entries:
+            raise BundleError(f'Too many files in zip (limit {self.max_entries}).')
+        if sum(info.file_size for info in infos) > self.max_bytes:
+            raise BundleError(f'Zip contents are larger than {self.max_bytes // (1024 * 1024)} MB.')
+        for info in infos:
+            if info.file_size > 1024 and info.file_size > self.max_ratio * max(info.compress_size, 1):
+                raise BundleError(f'{info.filename} is compressed suspiciously well; refusing to unpack it.')
+
+    @staticmethod
+    def _read_json(zf, name, budget):
+        data = bytearray()
+        with zf.open(name) as f:
+            while True:
+                chunk = f.read(64 * 1024)
+                if not chunk:
+                    break
+                data.extend(chunk)
+                budget.spend(len(chunk))
+        try:
+            return json.loads(data.decode('utf-8'))
+        except (UnicodeDecodeError, ValueError):
+            raise BundleError(f'Invalid JSON in {name}.')
+
+    @staticmethod
+    def _validate(name, data):
+        if not isinstance(data, dict):
+            raise BundleError(f'{name} must contain a JSON object.')
+        commands = data.get('commands', [])
+        if not isinstance(commands, list) or not all(isinstance(cmd, dict) and isinstance(cmd.get('command', ''), str) for cmd in commands):
+            raise BundleError(f'{name} has an invalid "commands" list.')
+
+    def read(self, fileobj):
+        """Yield ``(title, description, category, template_file, data)`` one template at a time"""
+        try:
+            zf = zipfile.ZipFile(fileobj)
+        except zipfile.BadZipFile:
+            raise BundleError('Invalid zip file.')
+
+        with zf:
+            self._check_directory(zf)
+            budget = _ByteBudget(self.max_bytes)
+            names = set(zf.namelist())
+
+            if 'metadata.json' not in names:
+                raise BundleError('Invalid template file: metadata.json not found.')
+            metadata = self._read_json(zf, 'metadata.json', budget)
+            if not isinstance(metadata, dict):
+                raise BundleError('metadata.json must contain a JSON object.')
+
+            entries = metadata.get('templates') if 'templates' in metadata else [metadata]
+            if not isinstance(entries, list) or not entries or not all(isinstance(entry, dict) for entry in entries):
+                raise BundleError('metadata.json "templates" must be a non-empty list of objects.')
+
+            for entry in entries:
+                template_file = entry.get('template_file', 'imported_template.json')
+                if template_file not in names:
+                    raise BundleError(f'Template file {template_file} not found in zip.')
+                data = self._read_json(zf, template_file, budget)
+                self._validate(template_file, data)
+                yield (
+                    entry.get('title', 'Imported Template'),
+                    entry.get('description', 'Imported from zip file'),
+                    entry.get('category', 'custom'),
+                    template_file,
+                    data
+                )
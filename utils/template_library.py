@@ -0,0 +1,62 @@
+import threading
+
+
+class TemplateLibrary:
+    """Parsed template payloads, kept in memory per worker.
+
+    Payloads live in the database as compressed blobs keyed by content hash
+    (see ``template_blobs``). A hash always names the same content, so cached
+    entries never go stale: an edit gives the template a new hash, and every
+    worker picks it up from the row it was already reading. Returned data is
+    shared; treat it as read-only.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self._payloads = {}  # content_hash -> data
+        self._ids = {}  # template id -> content_hash
+        self._lock = threading.Lock()
+
+    def _fetch(self, content_hashes):
+        missing = [h for h in content_hashes if h and h not in self._payloads]
+        if missing:
+            payloads = self.db.get_template_payloads(missing)
+            with self._lock:
+                self._payloads.update(payloads)
+
+    def load(self):
+        """Decode every current template payload in one query"""
+        templates = self.db.get_all_templates()
+        for template in templates:
+            self._ids[template['id']] = template['content_hash']
+        self._fetch([template['content_hash'] for template in templates])
+
+    def get_data(self, content_hash):
+        """Parsed payload for a content hash, or None when it is not stored"""
+        if content_hash not in self._payloads:
+            self._fetch([content_hash])
+        return self._payloads.get(content_hash)
+
+    def get(self, template_id):
+        """Current payload of a template by id, or None when no such template exists"""
+        content_hash = self._ids.get(template_id)
+        if content_hash is None:
+            template = self.db.get_template(template_id)
+            if not template:
+                return None
+            content_hash = self._ids[template_id] = template['content_hash']
+        return self.get_data(content_hash)
+
+    def attach_previews(self, templates):
+        self._fetch([template['content_hash'] for template in templates])
+        for template in templates:
+            self._ids[template['id']] = template['content_hash']
+            template['preview'] = self._payloads.get(template['content_hash']) or {}
+        return templates
+
+    def register(self, template_id, content_hash, data=None):
+        """Note a template's new content after a write through the database"""
+        self._ids[template_id] = content_hash
+        if data is not None:
+            with self._lock:
+                self._payloads[content_hash] = data
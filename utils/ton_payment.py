@@ -1,33 +1,176 @@
-
+import base64
+import os
 import requests
+import tempfile
+import threading
 import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from functools import lru_cache
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+NANOTONS_PER_TON = 1_000_000_000
+
+# User-friendly address tag bytes
+TAG_BOUNCEABLE = 0x11
+TAG_NON_BOUNCEABLE = 0x51
+TAG_TESTNET = 0x80
+
+
+def _crc16(data):
+    """CRC16-XMODEM, the checksum used by user-friendly TON addresses"""
+    crc = 0
+    for byte in data:
+        crc ^= byte << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x1021) if crc & 0x8000 else crc << 1
+            crc &= 0xFFFF
+    return crc
+
+
+@lru_cache(maxsize=4096)
+def parse_address(address):
+    """Decode a 48-character user-friendly address; None if it is malformed.
+
+    Both the base64 and base64url alphabets are accepted. Returns a dict with
+    ``workchain``, ``hash`` (32 bytes), ``bounceable`` and ``testnet``.
+    """
+    if not isinstance(address, str) or len(address) != 48:
+        return None
+    try:
+        data = base64.urlsafe_b64decode(address.replace('+', '-').replace('/', '_'))
+    except (ValueError, TypeError):
+        return None
+    if len(data) != 36 or _crc16(data[:34]) != int.from_bytes(data[34:], 'big'):
+        return None
+
+    tag = data[0]
+    testnet = bool(tag & TAG_TESTNET)
+    tag &= ~TAG_TESTNET
+    if tag not in (TAG_BOUNCEABLE, TAG_NON_BOUNCEABLE):
+        return None
+
+    workchain = data[1] if data[1] < 128 else data[1] - 256
+    return {
+        'workchain': workchain,
+        'hash': data[2:34],
+        'bounceable': tag == TAG_BOUNCEABLE,
+        'testnet': testnet
+    }
+
+
+def format_address(workchain, address_hash, bounceable=True, testnet=False):
+    """Encode a workchain and 32-byte account hash as a user-friendly address"""
+    tag = TAG_BOUNCEABLE if bounceable else TAG_NON_BOUNCEABLE
+    if testnet:
+        tag |= TAG_TESTNET
+    data = bytes([tag, workchain & 0xFF]) + bytes(address_hash)
+    data += _crc16(data).to_bytes(2, 'big')
+    return base64.urlsafe_b64encode(data).decode()
+
+
+class _RateLimiter:
+    """Spaces request starts at least 1/rate seconds apart across threads and processes.
+
+    The next free slot is kept in ``path`` under an exclusive ``flock``, so
+    gunicorn workers and the standalone watcher share one budget. Without
+    fcntl (Windows) the limit only holds within the process.
+    """
+
+    def __init__(self, rate, path=None):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.path = path
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def _reserve_shared(self, now):
+        with open(self.path, 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                try:
+                    next_slot = float(f.read().strip() or 0)
+                except ValueError:
+                    next_slot = 0.0
+                slot = max(now, next_slot)
+                f.seek(0)
+                f.truncate()
+                f.write(repr(slot + self.interval))
+                f.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+        return slot
+
+    def wait(self):
+        if not self.interval:
+            return
+        # Wall-clock time, since slots are compared across processes
+        now = time.time()
+        slot = None
+        if self.path and fcntl is not None:
+            try:
+                slot = self._reserve_shared(now)
+            except OSError as e:
+                print(f"TON rate limit file error: {e}")
+        if slot is None:
+            with self._lock:
+                slot = max(now, self._next)
+                self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
 
 class TONPayment:
-    def __init__(self):
-        self.toncenter_api = 'https://toncenter.com/api/v2'
+    def __init__(self, api_base=None, db=None, balance_ttl=None, max_workers=8, rate_limit=None, max_live_balances=None):
+        self.toncenter_api = (api_base or os.environ.get('TONCENTER_API_BASE', 'https://toncenter.com/api/v2')).rstrip('/')
+        self.api_key = os.environ.get('TONCENTER_API_KEY')
+        self.db = db
+        self.balance_ttl = balance_ttl if balance_ttl is not None else float(os.environ.get('TON_BALANCE_TTL', 30))
+        self.max_workers = max_workers
+        # toncenter allows about 1 request/second without an API key and 10 with one
+        rate = rate_limit or float(os.environ.get('TONCENTER_RPS', 10 if self.api_key else 1))
+        rate_file = os.environ.get('TONCENTER_RATE_FILE') or os.path.join(tempfile.gettempdir(), 'toncenter-rate')
+        self._limiter = _RateLimiter(rate, rate_file)
+        # Uncached balances one get_balances call may fetch; keeps a request from queueing behind the limiter
+        self.max_live_balances = max_live_balances or int(os.environ.get('TON_BALANCE_MAX_LIVE', 10 if self.api_key else 3))
+        self._balances = {}
+        self._balances_lock = threading.Lock()
+
+    def _get(self, method, params):
+        self._limiter.wait()
+        headers = {'X-API-Key': self.api_key} if self.api_key else {}
+        response = requests.get(f'{self.toncenter_api}/{method}', params=params, headers=headers, timeout=10)
+        response.raise_for_status()
+        return response.json()
         
     def validate_address(self, address):
-        """Validate TON wallet address format"""
-        if not address:
-            return False
-        if not (address.startswith('EQ') or address.startswith('UQ')):
-            return False
-        if len(address) != 48:
-            return False
-        return True
+        """Validate a mainnet user-friendly TON address, including its checksum"""
+        parsed = parse_address(address.strip()) if isinstance(address, str) else None
+        return bool(parsed) and not parsed['testnet'] and parsed['workchain'] in (0, -1)
+
+    def validate_ton_address(self, address):
+        return self.validate_address(address)
     
-    def get_transaction_info(self, address, limit=10):
-        """Get recent transactions for a TON address"""
+    def get_transaction_info(self, address, limit=10, lt=None, tx_hash=None):
+        """Get recent transactions for a TON address, newest first.
+
+        Pass the ``lt`` and ``tx_hash`` of a transaction to page backwards
+        starting from (and including) that transaction.
+        """
         try:
-            url = f'{self.toncenter_api}/getTransactions'
             params = {
                 'address': address,
                 'limit': limit
             }
-            response = requests.get(url, params=params, timeout=10)
-            response.raise_for_status()
-            data = response.json()
+            if lt and tx_hash:
+                params['lt'] = lt
+                params['hash'] = tx_hash
+            data = self._get('getTransactions', params)
             return data.get('result', [])
         except Exception as e:
             print(f"Error fetching TON transactions: {e}")
@@ -35,6 +178,22 @@ class TONPayment:
     
     def verify_payment(self, sender_address, receiver_address, amount, transaction_hash=None):
         """Verify a TON payment transaction"""
+        if self.db is not None:
+            # Look the payment up in the watcher's local transaction index; a transfer verifies one payment
+            tx = self.db.claim_ton_transaction(
+                receiver_address, sender_address,
+                int((amount - 0.01) * NANOTONS_PER_TON), int((amount + 0.01) * NANOTONS_PER_TON),
+                transaction_hash
+            )
+            if tx:
+                return {
+                    'verified': True,
+                    'transaction_hash': tx['tx_hash'],
+                    'amount': tx['amount_nano'] / NANOTONS_PER_TON,
+                    'timestamp': tx['utime']
+                }
+            return {'verified': False, 'error': 'Transaction not found'}
+
         try:
             transactions = self.get_transaction_info(receiver_address, limit=20)
             
@@ -58,19 +217,62 @@ class TONPayment:
             print(f"Error verifying TON payment: {e}")
             return {'verified': False, 'error': str(e)}
     
+    def _fetch_balance(self, address):
+        data = self._get('getAddressBalance', {'address': address})
+        balance = int(data.get('result', 0)) / NANOTONS_PER_TON
+        with self._balances_lock:
+            self._balances[address] = (time.monotonic() + self.balance_ttl, balance)
+        return balance
+
+    def _cached_balance(self, address):
+        with self._balances_lock:
+            entry = self._balances.get(address)
+        if entry and entry[0] > time.monotonic():
+            return entry[1]
+        return None
+
     def get_balance(self, address):
         """Get TON balance for an address"""
-        try:
-            url = f'{self.toncenter_api}/getAddressBalance'
-            params = {'address': address}
-            response = requests.get(url, params=params, timeout=10)
-            response.raise_for_status()
-            data = response.json()
-            balance = int(data.get('result', 0)) / 1e9
+        balance = self._cached_balance(address)
+        if balance is not None:
             return balance
+        try:
+            return self._fetch_balance(address)
         except Exception as e:
             print(f"Error fetching TON balance: {e}")
             return 0
+
+    def get_balances(self, addresses):
+        """Balances for many addresses, fetching at most ``max_live_balances`` uncached ones.
+
+        Returns ``(balances, pending)``: a dict of address -> balance, with
+        None for addresses that are invalid or fail to load, and the
+        addresses left unfetched this round for the caller to ask for again.
+        """
+        balances = {}
+        missing = []
+        for address in dict.fromkeys(a for a in addresses if a):
+            if not self.validate_address(address):
+                balances[address] = None
+                continue
+            balance = self._cached_balance(address)
+            if balance is None:
+                missing.append(address)
+            else:
+                balances[address] = balance
+
+        live, pending = missing[:self.max_live_balances], missing[self.max_live_balances:]
+        if live:
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(live))) as executor:
+                futures = {address: executor.submit(self._fetch_balance, address) for address in live}
+            for address, future in futures.items():
+                try:
+                    balances[address] = future.result()
+                except Exception as e:
+                    print(f"Error fetching TON balance for {address}: {e}")
+                    balances[address] = None
+
+        return balances, pending
     
     def create_payment_link(self, receiver_address, amount, comment=''):
         """Create a TON payment deep link"""
@@ -78,7 +280,7 @@ class TONPayment:
             return None
         
         # Convert to nanotons
-        nanotons = int(amount * 1e9)
+        nanotons = int(round(amount * NANOTONS_PER_TON))
         
         # Create ton:// link
         link = f"ton://transfer/{receiver_address}"
@@ -86,69 +288,9 @@ class TONPayment:
         if nanotons > 0:
             params.append(f"amount={nanotons}")
         if comment:
-            params.append(f"text={comment}")
+            params.append(f"text={urllib.parse.quote(comment)}")
         
         if params:
             link += "?" + "&".join(params)
         
         return link
-class TONPayment:
-    """Utility class for generating TON payment links"""
-    
-    def __init__(self):
-        pass
-    
-    def create_payment_link(self, recipient_address, amount, comment=""):
-        """
-        Create a TON payment link
-        
-        Args:
-            recipient_address: TON wallet address (EQ... or UQ...)
-            amount: Amount in TON
-            comment: Optional payment comment
-            
-        Returns:
-            Payment link string or None if invalid
-        """
-        if not recipient_address or not isinstance(amount, (int, float)):
-            return None
-        
-        # Validate TON address format
-        if not ((recipient_address.startswith('EQ') or recipient_address.startswith('UQ')) 
-                and len(recipient_address) == 48):
-            return None
-        
-        # Generate TON payment link
-        # Format: ton://transfer/<address>?amount=<amount>&text=<comment>
-        base_url = f"ton://transfer/{recipient_address}"
-        
-        # Convert amount to nanotons (1 TON = 1,000,000,000 nanotons)
-        nanotons = int(amount * 1_000_000_000)
-        
-        params = [f"amount={nanotons}"]
-        
-        if comment:
-            # URL encode the comment
-            import urllib.parse
-            encoded_comment = urllib.parse.quote(comment)
-            params.append(f"text={encoded_comment}")
-        
-        payment_link = f"{base_url}?{'&'.join(params)}"
-        
-        return payment_link
-    
-    def validate_ton_address(self, address):
-        """
-        Validate TON wallet address format
-        
-        Args:
-            address: TON wallet address to validate
-            
-        Returns:
-            Boolean indicating if address is valid
-        """
-        if not address or not isinstance(address, str):
-            return False
-        
-        return ((address.startswith('EQ') or address.startswith('UQ')) 
-                and len(address) == 48)
@@ -0,0 +1,164 @@
+import os
+import threading
+import time
+
+from utils.ton_payment import TONPayment
+
+
+class TONWatcher:
+    """Tails getTransactions for every owner wallet into the local index.
+
+    Each wallet keeps a logical-time (lt) cursor in ``ton_wallet_cursors``, so
+    a poll only pages back until it reaches transactions it has already seen.
+    When a backlog is deeper than ``max_pages`` the cursor stays put and the
+    paging position is saved, so the next poll carries on from there.
+    Incoming payments are matched to payment intents and pending deposits by
+    their comment nonce as they are stored. toncenter load is one request per
+    wallet per interval (more only while catching up), independent of how many
+    players are paying.
+    """
+
+    def __init__(self, db, ton_payment=None, interval=None, page_size=50, max_pages=10):
+        self.db = db
+        self.ton = ton_payment or TONPayment(db=db)
+        self.interval = interval or float(os.environ.get('TON_WATCHER_INTERVAL', 15))
+        self.page_size = page_size
+        self.max_pages = max_pages
+        self._stop = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def parse_transaction(raw):
+        """Flatten one toncenter transaction into index rows (one per message)"""
+        tx_id = raw.get('transaction_id', {})
+        lt = int(tx_id.get('lt', 0))
+        tx_hash = tx_id.get('hash', '')
+        utime = raw.get('utime', 0)
+        rows = []
+
+        in_msg = raw.get('in_msg') or {}
+        if in_msg.get('source'):
+            rows.append({
+                'lt': lt, 'tx_hash': tx_hash, 'utime': utime,
+                'direction': 'in', 'msg_index': 0,
+                'counterparty': in_msg.get('source'),
+                'amount_nano': int(in_msg.get('value', 0) or 0),
+                'comment': (in_msg.get('message') or '').strip() or None
+            })
+
+        for index, out_msg in enumerate(raw.get('out_msgs') or []):
+            rows.append({
+                'lt': lt, 'tx_hash': tx_hash, 'utime': utime,
+                'direction': 'out', 'msg_index': index,
+                'counterparty': out_msg.get('destination'),
+                'amount_nano': int(out_msg.get('value', 0) or 0),
+                'comment': (out_msg.get('message') or '').strip() or None
+            })
+
+        return rows
+
+    def poll_wallet(self, wallet_address):
+        cursor = self.db.get_ton_cursor(wallet_address)
+        last_lt = cursor['last_lt'] if cursor else 0
+        last_hash = cursor['last_hash'] if cursor else None
+
+        new_transactions = []
+        if cursor and cursor.get('scan_lt'):
+            # Resume the catch-up the previous poll ran out of pages on
+            newest = (cursor['scan_top_lt'], cursor['scan_top_hash'])
+            page_lt, page_hash = cursor['scan_lt'], cursor['scan_hash']
+        else:
+            newest = None
+            page_lt, page_hash = None, None
+
+        caught_up = False
+        for _ in range(self.max_pages):
+            page = self.ton.get_transaction_info(wallet_address, limit=self.page_size, lt=page_lt, tx_hash=page_hash)
+            if not page:
+                # A page fetched from a known transaction always includes it, so empty means the request failed
+                caught_up = page_lt is None
+                break
+
+            reached_cursor = False
+            for raw in page:
+                tx_id = raw.get('transaction_id', {})
+                lt = int(tx_id.get('lt', 0))
+                if page_lt and lt == int(page_lt):
+                    continue  # paging repeats the transaction we started from
+                if lt <= last_lt:
+                    reached_cursor = True
+                    break
+                if newest is None:
+                    newest = (lt, tx_id.get('hash'))
+                new_transactions.extend(self.parse_transaction(raw))
+
+            if reached_cursor or len(page) < self.page_size or not cursor:
+                # A wallet seen for the first time only gets its latest page indexed
+                caught_up = True
+                break
+
+            oldest = page[-1].get('transaction_id', {})
+            page_lt, page_hash = oldest.get('lt'), oldest.get('hash')
+
+        if newest is None:
+            return {'stored': 0, 'matched': 0}
+
+        if caught_up:
+            return self.db.record_ton_transactions(wallet_address, new_transactions, newest[0], newest[1])
+
+        # Stopped short of last_lt: keep it, and page on from here next time so nothing in between is skipped
+        return self.db.record_ton_transactions(wallet_address, new_transactions, last_lt, last_hash,
+                                               scan=(page_lt, page_hash, newest[0], newest[1]))
+
+    def run_once(self):
+        totals = {'wallets': 0, 'stored': 0, 'matched': 0}
+        for wallet_address in self.db.get_owner_ton_wallets():
+            try:
+                result = self.poll_wallet(wallet_address)
+            except Exception as e:
+                print(f"TON watcher error for {wallet_address}: {e}")
+                continue
+            totals['wallets'] += 1
+            totals['stored'] += result['stored']
+            totals['matched'] += result['matched']
+        totals['expired'] = self.db.expire_payment_intents()
+        return totals
+
+    def _loop(self):
+        while not self._stop.is_set():
+            started = time.monotonic()
+            self.run_once()
+            self._stop.wait(max(0.0, self.interval - (time.monotonic() - started)))
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name='ton-watcher', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+
+def main():
+    import argparse
+    from utils.database import Database
+
+    parser = argparse.ArgumentParser(description='Index incoming TON payments for owner wallets')
+    parser.add_argument('--db', default=os.environ.get('DATABASE_PATH', 'database.db'))
+    parser.add_argument('--once', action='store_true', help='poll every wallet once and exit')
+    args = parser.parse_args()
+
+    watcher = TONWatcher(Database(args.db))
+    if args.once:
+        print(watcher.run_once())
+        return
+
+    print(f"Watching owner wallets every {watcher.interval:.0f}s")
+    while True:
+        print(watcher.run_once())
+        time.sleep(watcher.interval)
+
+
+if __name__ == '__main__':
+    main()